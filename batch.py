@@ -0,0 +1,230 @@
+"""
+Batch rendering of many scripts in one run.
+
+Scripts are given one by one, as folders (every .txt file in them) or as
+YAML manifests listing them. Every script is a job, rendered into its own
+<output>/<script name>/ folder with its own output.xml, or
+<output>/<parent folder>/<script name>/ when scripts of several folders
+have the same name. Jobs are spread
+over a pool of worker processes that stay alive for the whole batch, so
+fonts, profile pictures, emoji and the speaker configuration are loaded
+once per worker instead of once per script.
+
+A manifest is a list of script paths, or of mappings with a script path and
+optionally its own output folder and start time:
+
+    - scripts/intro.txt
+    - script: scripts/outro.txt
+      output: renders/final
+      start_time: 2024-05-01T15:20
+
+Relative paths in a manifest are relative to the manifest's folder.
+"""
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import os
+import time
+
+import yaml
+
+import profiling
+import renderer
+from frame_cache import get_cached_start_time
+from sinks import PngSink
+from xml_builder import create_xml
+from video import VideoSink, has_ffmpeg
+
+MANIFEST_EXTENSIONS = ('.yaml', '.yml')
+SCRIPT_EXTENSION = '.txt'
+
+# A script to render, and where its frames and XML go
+Job = collections.namedtuple('Job', ['script_path', 'chat_directory', 'xml_path', 'start_time'])
+
+# Outcome of a job, error is None when it succeeded and samples are the
+# timing samples of the process that ran it (see profiling.py)
+JobResult = collections.namedtuple('JobResult', ['job', 'frames', 'render_seconds', 'xml_seconds', 'error', 'samples'])
+
+
+def read_manifest(path):
+    """Read the entries of a batch manifest, as (script path, output folder, start time) tuples"""
+    with open(path, encoding='utf-8') as f:
+        entries = yaml.safe_load(f) or []
+    if not isinstance(entries, list):
+        raise ValueError(f'{path}: a batch manifest must be a list of scripts')
+
+    base = os.path.dirname(os.path.abspath(path))
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'script': entry}
+        if not isinstance(entry, dict) or 'script' not in entry:
+            raise ValueError(f'{path}: invalid entry {entry!r}, expected a script path')
+        output = entry.get('output')
+        start_time = entry.get('start_time')
+        if isinstance(start_time, str):
+            start_time = datetime.datetime.fromisoformat(start_time)
+        yield (
+            os.path.join(base, entry['script']),
+            os.path.join(base, output) if output else None,
+            start_time
+        )
+
+
+def collect_scripts(paths):
+    """Expand folders and manifests into (script path, output folder, start time) tuples"""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(SCRIPT_EXTENSION):
+                    yield os.path.join(path, name), None, None
+        elif path.endswith(MANIFEST_EXTENSIONS):
+            yield from read_manifest(path)
+        else:
+            yield path, None, None
+
+
+def get_script_name(script_path):
+    """Get the name of a script, without its folder and extension"""
+    return os.path.splitext(os.path.basename(script_path))[0]
+
+
+def make_jobs(paths, output_directory, start_time=None):
+    """
+    Create the jobs of a batch.
+
+    Scripts without their own output folder are rendered into
+    output_directory/<script name>, or output_directory/<parent folder>/<script name>
+    when several scripts have the same name. Scripts without their own start
+    time use start_time, or else the start time of their last render, or now.
+
+    Raises:
+        ValueError: When two jobs would still write to the same folder, as
+                    their workers would overwrite each other's frames.
+    """
+    scripts = list(collect_scripts(paths))
+    name_counts = collections.Counter(get_script_name(script_path) for script_path, script_output, script_start_time in scripts)
+
+    jobs = []
+    outputs = {}
+    for script_path, script_output, script_start_time in scripts:
+        if script_output is None:
+            name = get_script_name(script_path)
+            if name_counts[name] > 1:
+                name = os.path.join(os.path.basename(os.path.dirname(os.path.abspath(script_path))), name)
+            script_output = os.path.join(output_directory, name)
+        output_key = os.path.normcase(os.path.abspath(script_output))
+        if output_key in outputs:
+            raise ValueError(f'{outputs[output_key]} and {script_path} would both be rendered into {script_output}, give them their own output folders')
+        outputs[output_key] = script_path
+        chat_directory = os.path.join(script_output, 'chat')
+        job_start_time = (
+            script_start_time or start_time
+            or get_cached_start_time(chat_directory, script_path)
+            or datetime.datetime.now()
+        )
+        jobs.append(Job(script_path, chat_directory, os.path.join(script_output, 'output.xml'), job_start_time))
+    return jobs
+
+
+def get_video_path(job):
+    """Get the path of the video of a job, next to its XML"""
+    return os.path.join(os.path.dirname(job.xml_path), 'output.mp4')
+
+
+def init_worker(font_styles):
+    """Set up a batch worker process with the same fonts as the main process, and load its caches"""
+    renderer.init_worker(font_styles)
+    renderer.warm_caches()
+
+
+def run_job(job, dt=30, use_cache=True, png_profile='default', video=False, conversation=False):
+    """
+    Render the frames and XML of one job, errors are returned rather than raised.
+
+    With video, the same render is also encoded into the job's video.
+    """
+    render_start = time.perf_counter()
+    sinks = None
+    video_sink = None
+    if video:
+        if not has_ffmpeg():
+            return JobResult(job, 0, 0.0, 0.0, 'could not find ffmpeg', profiling.take_samples())
+        video_sink = VideoSink(output_path=get_video_path(job))
+        sinks = [PngSink(job.chat_directory, png_profile), video_sink]
+    try:
+        # The video is only encoded once every frame was rendered, and aborted otherwise
+        with open(job.script_path, encoding='utf8') as f, video_sink or contextlib.nullcontext():
+            frames = renderer.save_images(
+                f,
+                init_time=job.start_time,
+                nums_to_skip=[],
+                dt=dt,
+                use_cache=use_cache,
+                script_path=job.script_path,
+                directory=job.chat_directory,
+                png_profile=png_profile,
+                conversation=conversation,
+                sinks=sinks
+            )
+    except (OSError, ValueError, KeyError) as e:
+        return JobResult(job, 0, time.perf_counter() - render_start, 0.0, str(e), profiling.take_samples())
+
+    xml_start = time.perf_counter()
+    written = create_xml(frames, output_path=job.xml_path)
+    xml_seconds = time.perf_counter() - xml_start
+    error = None if written else 'could not write the XML'
+    if video_sink is not None and not video_sink.succeeded:
+        error = 'could not encode the video'
+    return JobResult(job, len(frames), xml_start - render_start, xml_seconds, error, profiling.take_samples())
+
+
+def run_batch(jobs, workers=1, dt=30, use_cache=True, png_profile='default', video=False, conversation=False):
+    """
+    Render every job, on a pool of worker processes when workers > 1.
+
+    Each job is rendered by a single worker, so a batch scales with the
+    number of scripts rather than the number of speaker blocks in a script.
+
+    Yields:
+        The JobResult of every job, as soon as it is done.
+    """
+    if workers > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(workers, len(jobs)),
+            initializer=init_worker,
+            initargs=(renderer.fonts.styles,)
+        ) as executor:
+            futures = [executor.submit(run_job, job, dt, use_cache, png_profile, video, conversation) for job in jobs]
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+    else:
+        renderer.warm_caches()
+        for job in jobs:
+            yield run_job(job, dt, use_cache, png_profile, video, conversation)
+
+
+def format_report(results, total_seconds):
+    """Format a table of the time spent on every job"""
+    rows = [('Script', 'Frames', 'Render (s)', 'XML (s)', 'Frames/s', 'Status')]
+    for result in results:
+        fps = result.frames / result.render_seconds if result.render_seconds else 0.0
+        rows.append((
+            result.job.script_path,
+            str(result.frames),
+            f'{result.render_seconds:.2f}',
+            f'{result.xml_seconds:.2f}',
+            f'{fps:.1f}',
+            '✅' if result.error is None else f'❌ {result.error}'
+        ))
+    frames = sum(result.frames for result in results)
+    rows.append(('Total', str(frames), f'{total_seconds:.2f}', '', f'{frames / total_seconds if total_seconds else 0.0:.1f}', ''))
+
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]) - 1)]
+    lines = []
+    for i, row in enumerate(rows):
+        cells = [cell.ljust(width) if column == 0 else cell.rjust(width) for column, (cell, width) in enumerate(zip(row, widths))]
+        lines.append('  '.join(cells + [row[-1]]).rstrip())
+        if i == 0 or i == len(rows) - 2:
+            lines.append('  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
@@ -0,0 +1,175 @@
+"""
+Rendering benchmark on synthetic scripts.
+
+    python benchmark.py
+    python benchmark.py --sizes 10 100 --workers 1 --json results.json
+
+Generates scripts of 10, 100, 1k and 10k messages, with the speakers from
+details.yaml, markdown, mentions, emoji, wrapped lines and $xN duplication,
+then times save_images and create_xml on each, reporting frames per second,
+XML time and peak memory. Every size runs in a fresh process, so its peak
+RSS is not inflated by the sizes before it. Frames are written to a
+temporary folder and the frame cache is not used, so every frame is
+rendered. Run it from the textshotter folder.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is not reported there
+    resource = None
+
+SIZES = (10, 100, 1000, 10000)
+SEED = 1
+
+# Most messages a speaker block holds
+MAX_BLOCK_FRAMES = 8
+
+WORDS = ('the', 'planet', 'who', 'asked', 'lol', 'true', 'humanity', 'ok', 'never', 'again', 'bro', 'what', 'is', 'this', 'chat')
+EMOJI = ('😀', '🔥', '👍', '😂', '💀')
+MARKDOWN = ('*{}*', '**{}**', '***{}***', '~~{}~~', '`{}`', '__{}__')
+
+
+def generate_message(rng, speakers):
+    """Generate a random message line, without its suffixes"""
+    # One message in ten is long enough to wrap onto several lines
+    words = [rng.choice(WORDS) for _ in range(rng.randint(1, 5) if rng.random() < 0.9 else rng.randint(30, 80))]
+    kind = rng.random()
+    if kind < 0.2:
+        i = rng.randrange(len(words))
+        words[i] = rng.choice(MARKDOWN).format(words[i])
+    elif kind < 0.3:
+        words.insert(0, '@' + rng.choice(speakers))
+    elif kind < 0.4:
+        words.append(rng.choice(EMOJI))
+    return ' '.join(words)
+
+
+def generate_script(messages, speakers, seed=SEED):
+    """
+    Generate the lines of a script with the given number of message lines.
+
+    Blocks alternate between random speakers and hold at most
+    MAX_BLOCK_FRAMES frames, counting duplicated messages.
+    """
+    rng = random.Random(seed)
+    lines = []
+    written = 0
+    while written < messages:
+        lines.append(f'{rng.choice(speakers)}:')
+        frames = 0
+        for _ in range(min(rng.randint(1, MAX_BLOCK_FRAMES), messages - written)):
+            if frames == MAX_BLOCK_FRAMES:
+                break
+            line = f'{generate_message(rng, speakers)}$^{rng.choice((0.5, 0.7, 1))}'
+            duplication = 1
+            if rng.random() < 0.1 and frames + 2 <= MAX_BLOCK_FRAMES:
+                duplication = rng.randint(2, MAX_BLOCK_FRAMES - frames)
+                line += f'$x{duplication}'
+            lines.append(line)
+            frames += duplication
+            written += 1
+        lines.append('')
+    return lines
+
+
+def get_peak_rss_mb():
+    """Peak resident memory of this process and its finished workers, in MB"""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_case(messages, workers, seed=SEED):
+    """Render a synthetic script and write its XML, returns the measurements of the run"""
+    from renderer import save_images, get_config
+    from xml_builder import create_xml
+
+    lines = generate_script(messages, sorted(get_config()), seed)
+    directory = tempfile.mkdtemp(prefix='textshotter-benchmark-')
+    try:
+        start = time.perf_counter()
+        frames = save_images(lines, datetime.datetime(2024, 1, 1, 12, 0), [], workers=workers, use_cache=False, directory=directory)
+        render_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        create_xml(frames, output_path=os.path.join(directory, 'output.xml'))
+        xml_seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'messages': messages,
+        'frames': len(frames),
+        'workers': workers,
+        'render_seconds': render_seconds,
+        'frames_per_second': len(frames) / render_seconds,
+        'xml_seconds': xml_seconds,
+        'peak_rss_mb': get_peak_rss_mb()
+    }
+
+
+def run_benchmark(sizes=SIZES, workers=1, seed=SEED):
+    """Run every size in its own process, returns their measurements"""
+    results = []
+    for messages in sizes:
+        print(f'⏱️ {messages} messages')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+            results.append(executor.submit(run_case, messages, workers, seed).result())
+    return results
+
+
+def format_results(results):
+    """Format a table of benchmark measurements"""
+    rows = [('Messages', 'Frames', 'Render (s)', 'Frames/s', 'XML (s)', 'Peak RSS (MB)')]
+    for result in results:
+        rss = result['peak_rss_mb']
+        rows.append((
+            str(result['messages']),
+            str(result['frames']),
+            f"{result['render_seconds']:.2f}",
+            f"{result['frames_per_second']:.1f}",
+            f"{result['xml_seconds']:.3f}",
+            'n/a' if rss is None else f'{rss:.0f}'
+        ))
+
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    lines = []
+    for i, row in enumerate(rows):
+        lines.append('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
+        if i == 0:
+            lines.append('  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark rendering and XML generation on synthetic scripts.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='numbers of messages of the generated scripts (default: 10 100 1000 10000)')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='processes used to render speaker blocks in parallel (default: one per CPU)')
+    parser.add_argument('--seed', type=int, default=SEED, help='seed of the generated scripts, the same seed gives the same scripts')
+    parser.add_argument('--json', metavar='PATH', help='also save the measurements as JSON, to compare runs')
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.sizes, args.workers, args.seed)
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'date': datetime.datetime.now().isoformat(), 'seed': args.seed, 'results': results}, f, indent=2)
+        print(f'📄 {os.path.abspath(args.json)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
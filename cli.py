@@ -0,0 +1,216 @@
+"""
+Headless command line renderer, for rendering without the GUI or a display.
+
+    python cli.py scripts/test_script.txt
+    python cli.py scripts/a.txt scripts/b.txt --output renders --workers 8
+    python cli.py scripts/ --output renders --workers 8
+    python cli.py batch.yaml --output renders
+
+Run it from the textshotter folder, fonts, profile pictures and details.yaml
+are looked up there. A single script is rendered into OUTPUT/chat and
+OUTPUT/output.xml, with its speaker blocks rendered in parallel. Several
+scripts, folders of scripts or batch manifests are rendered as a batch (see
+batch.py), each script into its own OUTPUT/<script name>/ folder, followed by
+a report of the time spent on each. Only the rendering backend is imported,
+and only once the arguments are parsed.
+"""
+import argparse
+import contextlib
+import datetime
+import os
+import sys
+
+import profiling
+from frame_cache import get_cached_start_time
+
+
+def parse_start_time(value):
+    """Parse a start time given as HH:MM (today) or as an ISO date and time"""
+    try:
+        time = datetime.datetime.strptime(value, '%H:%M').time()
+        return datetime.datetime.combine(datetime.date.today(), time)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid start time {value!r}, expected HH:MM or an ISO date and time')
+
+
+def parse_font_size(value):
+    """Parse a STYLE=SIZE font size override"""
+    style, _, size = value.partition('=')
+    if not size.isdigit():
+        raise argparse.ArgumentTypeError(f'invalid font size {value!r}, expected STYLE=SIZE, e.g. message=44')
+    return style, int(size)
+
+
+def is_single_script(paths):
+    """Whether the paths are a single script file, rather than a batch"""
+    return len(paths) == 1 and os.path.isfile(paths[0]) and not paths[0].endswith(('.yaml', '.yml'))
+
+
+def get_video_path(xml_path):
+    """Get the path of the video written next to an XML"""
+    return os.path.join(os.path.dirname(xml_path), 'output.mp4')
+
+
+def render_script(script_path, chat_directory, xml_path, start_time, dt=30, workers=1, use_cache=True, png_profile='default', conversation=False, video_path=None):
+    """
+    Render the frames of a script and write its XML, returns whether the XML was written.
+
+    With video_path, the same render is also encoded into that video, and
+    the result tells whether both were written.
+    """
+    from renderer import save_images
+    from sinks import PngSink
+    from xml_builder import create_xml
+
+    sinks = None
+    video_sink = None
+    if video_path is not None:
+        from video import VideoSink, has_ffmpeg
+        if not has_ffmpeg():
+            return False
+        video_sink = VideoSink(output_path=video_path)
+        sinks = [PngSink(chat_directory, png_profile), video_sink]
+
+    # The video is only encoded once every frame was rendered, and aborted otherwise
+    with open(script_path, encoding='utf8') as f, video_sink or contextlib.nullcontext():
+        frames = save_images(
+            f,
+            init_time=start_time,
+            nums_to_skip=[],
+            dt=dt,
+            workers=workers,
+            use_cache=use_cache,
+            script_path=script_path,
+            directory=chat_directory,
+            png_profile=png_profile,
+            conversation=conversation,
+            sinks=sinks
+        )
+    return create_xml(frames, output_path=xml_path) and (video_sink is None or video_sink.succeeded)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Render textshotter scripts to chat frames and a Premiere Pro XML, without the GUI.')
+    parser.add_argument('scripts', nargs='+', help='script files, folders of scripts or batch manifests (.yaml) to render')
+    parser.add_argument('-o', '--output', default='.', help='output folder (default: current folder)')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='processes used to render speaker blocks, or the scripts of a batch, in parallel (default: one per CPU)')
+    parser.add_argument('--start-time', type=parse_start_time, help='time of the first message, HH:MM or ISO date and time (default: the last run\'s, or now)')
+    parser.add_argument('--dt', type=int, default=30, help='seconds between messages (default: 30)')
+    parser.add_argument('--font-size', type=parse_font_size, action='append', default=[], metavar='STYLE=SIZE', help='override the size of a font style (name, time, message, bold, italic, bold_italic, monospace), message also resizes its bold, italic and monospace styles, can be repeated')
+    parser.add_argument('--png-profile', choices=['default', 'fast', 'archival', 'compact'], default='default', help='how frame images are encoded: fast (low compression), archival (optimised) or compact (256 color palette) (default: default)')
+    parser.add_argument('--conversation', action='store_true', help='show the whole conversation so far in every frame, scrolling like Discord, rather than only the current speaker\'s messages')
+    parser.add_argument('--video', action='store_true', help='also encode the frames into output.mp4 next to the XML, needs ffmpeg')
+    parser.add_argument('--watch', action='store_true', help='keep running and render the script again every time it or details.yaml is saved (single script only)')
+    parser.add_argument('--trace', metavar='PATH', help='also save the timing of every stage as a JSON trace, for chrome://tracing or ui.perfetto.dev')
+    parser.add_argument('--no-cache', action='store_true', help='render every frame, even when the existing image is up to date')
+    return parser
+
+
+def render_batch(args):
+    """Render several scripts as a batch and print the time spent on each, returns the exit code"""
+    import time
+    from batch import make_jobs, run_batch, format_report
+
+    try:
+        jobs = make_jobs(args.scripts, args.output, args.start_time)
+    except (OSError, ValueError) as e:
+        print(f'❌ Could not read the batch: {e}')
+        return 1
+    print(f'🎬 Rendering {len(jobs)} scripts')
+
+    start = time.perf_counter()
+    results = []
+    for result in run_batch(jobs, workers=args.workers, dt=args.dt, use_cache=not args.no_cache, png_profile=args.png_profile, video=args.video, conversation=args.conversation):
+        if result.error is None:
+            print(f'📄 {os.path.abspath(result.job.xml_path)}')
+        else:
+            print(f'❌ Could not render {result.job.script_path}: {result.error}')
+        results.append(result)
+        profiling.merge_samples(result.samples)
+    results.sort(key=lambda result: jobs.index(result.job))
+    print(format_report(results, time.perf_counter() - start))
+
+    return 1 if any(result.error is not None for result in results) else 0
+
+
+def render_single(args):
+    """Render a single script, returns the exit code"""
+    script_path = args.scripts[0]
+    chat_directory, xml_path = os.path.join(args.output, 'chat'), os.path.join(args.output, 'output.xml')
+    start_time = args.start_time or get_cached_start_time(chat_directory, script_path) or datetime.datetime.now()
+    print(f'🎬 Rendering {script_path}')
+    try:
+        written = render_script(
+            script_path,
+            chat_directory,
+            xml_path,
+            start_time,
+            dt=args.dt,
+            workers=args.workers,
+            use_cache=not args.no_cache,
+            png_profile=args.png_profile,
+            conversation=args.conversation,
+            video_path=get_video_path(xml_path) if args.video else None
+        )
+        if written and args.video:
+            print(f'🎞️ {os.path.abspath(get_video_path(xml_path))}')
+    except (OSError, ValueError, KeyError) as e:
+        print(f'❌ Could not render {script_path}: {e}')
+        written = False
+    if written:
+        print(f'📄 {os.path.abspath(xml_path)}')
+
+    return 0 if written else 1
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.font_size:
+        from renderer import fonts, set_font_size
+        for style, size in args.font_size:
+            if style not in fonts.styles:
+                print(f'❌ Unknown font style {style!r}, expected one of {", ".join(fonts.styles)}')
+                return 2
+            set_font_size(style, size)
+
+    single = is_single_script(args.scripts)
+    if args.watch and not single:
+        print('❌ --watch only works with a single script')
+        return 2
+
+    code = render_and_report(args, render_single if single else render_batch)
+    if args.watch:
+        watch_script(args)
+    return code
+
+
+def render_and_report(args, render):
+    """Run a render function and print the time spent in every stage, returns its exit code"""
+    profiling.reset()
+    code = render(args)
+    print(profiling.format_report())
+    if args.trace:
+        profiling.write_trace(args.trace)
+        print(f'⏱️ {os.path.abspath(args.trace)}')
+    return code
+
+
+def watch_script(args):
+    """Render the script again every time it or the speaker configuration is saved, until interrupted"""
+    from renderer import CONFIG_PATH
+    from watcher import watch
+
+    print(f'👀 Watching {args.scripts[0]} and {CONFIG_PATH}, press Ctrl+C to stop')
+    try:
+        watch([args.scripts[0], CONFIG_PATH], lambda: render_and_report(args, render_single))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
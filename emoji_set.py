@@ -0,0 +1,16 @@
+import os
+
+# Kept apart from emoji_source, which imports Pilmoji, so the emoji set can be
+# located (e.g. for the frame cache fingerprint) without loading Pilmoji.
+
+LOCAL_DIRECTORY = os.getcwd()
+
+# Directory or zip archive of emoji PNGs named after their code points, e.g. 1f600.png
+# (the layout of the Twemoji 72x72 assets). Custom Discord emoji go in discord/<id>.png
+EMOJI_PATH = os.path.join(LOCAL_DIRECTORY, 'emoji')
+EMOJI_ARCHIVE_PATH = os.path.join(LOCAL_DIRECTORY, 'emoji.zip')
+
+
+def get_emoji_path():
+    """Get the emoji set in use, the archive when there is one, else the directory"""
+    return EMOJI_ARCHIVE_PATH if os.path.isfile(EMOJI_ARCHIVE_PATH) else EMOJI_PATH
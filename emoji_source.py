@@ -0,0 +1,106 @@
+from pilmoji.source import BaseSource
+from PIL import Image
+import functools
+import zipfile
+import io
+import os
+
+from emoji_set import EMOJI_PATH, EMOJI_ARCHIVE_PATH, get_emoji_path
+
+EMOJI_CACHE_SIZE = 512
+
+
+def emoji_filenames(emoji):
+    """
+    Get the file names an emoji may be stored under.
+
+    Emoji sets disagree on whether the FE0F variation selector is part of the
+    name, so both spellings are tried.
+    """
+    codepoints = [f'{ord(char):x}' for char in emoji]
+    names = ['-'.join(codepoints) + '.png']
+    without_selector = [codepoint for codepoint in codepoints if codepoint != 'fe0f']
+    if without_selector != codepoints:
+        names.append('-'.join(without_selector) + '.png')
+    return names
+
+
+class LocalEmojiSource(BaseSource):
+    """
+    Emoji source for Pilmoji that reads emoji PNGs from a local directory or
+    zip archive instead of fetching them over HTTP.
+
+    File contents are read once, and get_emoji_image keeps an LRU of decoded
+    emoji so each one is decoded once per process.
+    """
+
+    def __init__(self, path=None, cache_size=EMOJI_CACHE_SIZE):
+        if path is None:
+            path = get_emoji_path()
+        self.path = path
+        self.is_archive = os.path.isfile(path) and zipfile.is_zipfile(path)
+        self._archive = None
+        self._archive_names = None
+        self.read_file = functools.lru_cache(maxsize=cache_size)(self._read_file)
+        self.get_emoji_image = functools.lru_cache(maxsize=cache_size)(self._load_emoji_image)
+        self.get_discord_emoji_image = functools.lru_cache(maxsize=cache_size)(self._load_discord_emoji_image)
+
+    def _open_archive(self):
+        """Open the zip archive and index its members by file name"""
+        if self._archive is None:
+            self._archive = zipfile.ZipFile(self.path)
+            self._archive_names = {}
+            for member in self._archive.namelist():
+                # Keep a discord/ prefix so custom emoji don't clash with unicode ones
+                parts = member.split('/')
+                key = '/'.join(parts[-2:]) if len(parts) > 1 and parts[-2] == 'discord' else parts[-1]
+                self._archive_names.setdefault(key, member)
+        return self._archive
+
+    def _read_file(self, name):
+        """Read an emoji file, returns None if it is not part of the set"""
+        if self.is_archive:
+            archive = self._open_archive()
+            member = self._archive_names.get(name)
+            return archive.read(member) if member else None
+
+        file_path = os.path.join(self.path, *name.split('/'))
+        if not os.path.isfile(file_path):
+            return None
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+    def read_emoji(self, emoji):
+        """Get the PNG data of an emoji, or None if there is no image for it"""
+        for name in emoji_filenames(emoji):
+            data = self.read_file(name)
+            if data:
+                return data
+        return None
+
+    def _decode(self, data):
+        """Decode PNG data to RGBA"""
+        if data is None:
+            return None
+        with Image.open(io.BytesIO(data)) as image:
+            return image.convert('RGBA')
+
+    def _load_emoji_image(self, emoji):
+        """Decode an emoji, or None if there is no image for it"""
+        return self._decode(self.read_emoji(emoji))
+
+    def _load_discord_emoji_image(self, id):
+        """Decode a custom Discord emoji, or None if there is no image for it"""
+        return self._decode(self.read_file(f'discord/{int(id)}.png'))
+
+    def get_emoji(self, emoji, /):
+        # Pilmoji closes the streams it gets, so hand out a fresh one every time
+        data = self.read_emoji(emoji)
+        return io.BytesIO(data) if data else None
+
+    def get_discord_emoji(self, id, /):
+        data = self.read_file(f'discord/{int(id)}.png')
+        return io.BytesIO(data) if data else None
+
+    def __repr__(self):
+        return f'<LocalEmojiSource path={self.path!r}>'
@@ -0,0 +1,42 @@
+from PIL import ImageFont
+import functools
+import os
+
+LOCAL_DIRECTORY = os.getcwd()
+FONT_DIRECTORY = os.path.join(LOCAL_DIRECTORY, 'fonts')
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(file, size):
+    """Load a font from the fonts folder, each (file, size) is only loaded once per process"""
+    return ImageFont.truetype(os.path.join(FONT_DIRECTORY, file), size)
+
+
+class FontRegistry:
+    """
+    Fonts by text style, loaded on first use.
+
+    Only the font file and size of each style are stored, the faces themselves
+    come from load_font, so styles using the same file and size share one
+    face. The styles are plain data and can be handed to worker processes,
+    which then load the faces they use on their own.
+    """
+
+    def __init__(self, styles):
+        self.styles = dict(styles)
+
+    def __getitem__(self, style):
+        return load_font(*self.styles[style])
+
+    def set_size(self, style, size):
+        """Change the size of a style, only that style's face gets loaded again"""
+        file, _ = self.styles[style]
+        self.styles[style] = (file, size)
+
+    def update(self, styles):
+        """Use the given (file, size) for every style in styles"""
+        self.styles.update(styles)
+
+    def paths(self):
+        """Get the paths of the font files used by all styles"""
+        return sorted({os.path.join(FONT_DIRECTORY, file) for file, size in self.styles.values()})
@@ -0,0 +1,127 @@
+import collections
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+from frames import frame_filename
+
+# Lists, for every frame image in a chat folder, the hash of the inputs it was
+# rendered from, so frames whose inputs did not change are not rendered again
+MANIFEST_NAME = '.frame_cache.json'
+
+
+def load_manifest(directory):
+    """Load the frame cache manifest of a chat folder, or an empty one"""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest.setdefault('frames', {})
+    return manifest
+
+
+def save_manifest(directory, manifest):
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def get_cached_start_time(directory, script_path):
+    """Get the start time of the last run of this script, so regenerating it gives the same timestamps"""
+    manifest = load_manifest(directory)
+    if script_path is None or manifest.get('script') != os.path.abspath(script_path):
+        return None
+    try:
+        return datetime.datetime.fromisoformat(manifest['start_time'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def hash_inputs(*inputs):
+    """Start a hash of render inputs, which can then be extended frame by frame"""
+    return hashlib.sha1(repr(inputs).encode('utf-8'))
+
+
+def file_fingerprint(path):
+    """Identify the version of a file an asset was built from"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (path, None)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+def is_cached(entry, path, key):
+    """Whether the image at path is the one recorded in the manifest entry for this key"""
+    if entry is None or entry[0] != key:
+        return False
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return [stat.st_size, stat.st_mtime_ns] == entry[1:]
+
+
+def record_frame(manifest, directory, number, key):
+    """Record the inputs hash of a frame image that was just written"""
+    stat = os.stat(os.path.join(directory, frame_filename(number)))
+    manifest['frames'][frame_filename(number)] = [key, stat.st_size, stat.st_mtime_ns]
+
+
+def relocate_frames(manifest, directory, wanted):
+    """
+    Rename frame images that are wanted under another file name.
+
+    When messages are added or removed, the frames after them are numbered
+    differently but may still look the same. Every up to date image whose
+    key is wanted under a file name that does not already hold it is moved
+    (or copied, when it is also wanted elsewhere) there, and the manifest is
+    updated, so those frames are found in the cache instead of rendered.
+
+    Args:
+        manifest: The frame cache manifest of the folder, updated in place.
+        directory: The chat folder.
+        wanted: The key of every frame about to be rendered, by file name.
+
+    Returns:
+        The number of frames relocated.
+    """
+    frames = manifest['frames']
+    sources = {}
+    for filename, entry in frames.items():
+        if is_cached(entry, os.path.join(directory, filename), entry[0]):
+            sources.setdefault(entry[0], filename)
+
+    moves = collections.defaultdict(list)
+    for filename, key in wanted.items():
+        entry = frames.get(filename)
+        if key in sources and (entry is None or entry[0] != key):
+            moves[key].append(filename)
+    if not moves:
+        return 0
+
+    # Move every source aside first, it may be the destination of another move
+    staged = {}
+    for key in moves:
+        source = sources[key]
+        staged[key] = os.path.join(directory, f'{key}.png.tmp')
+        if wanted.get(source) == key:
+            # The source is up to date where it is, it is only copied
+            shutil.copy2(os.path.join(directory, source), staged[key])
+        else:
+            os.replace(os.path.join(directory, source), staged[key])
+            del frames[source]
+
+    for key, destinations in moves.items():
+        for destination in destinations[:-1]:
+            shutil.copy2(staged[key], os.path.join(directory, destination))
+        os.replace(staged[key], os.path.join(directory, destinations[-1]))
+        for destination in destinations:
+            stat = os.stat(os.path.join(directory, destination))
+            frames[destination] = [key, stat.st_size, stat.st_mtime_ns]
+
+    return sum(len(destinations) for destinations in moves.values())
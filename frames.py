@@ -0,0 +1,71 @@
+from array import array
+import os
+
+
+def frame_filename(number):
+    """Get the file name of a frame image from its number"""
+    return f'{number:03d}.png'
+
+
+def frame_path(directory, number):
+    """Get the path of a frame image from its number"""
+    return os.path.join(directory, frame_filename(number))
+
+
+class FrameTable:
+    """
+    Compact, column-oriented list of the frames of a render, in playback order.
+
+    Every frame is a row of four columns stored in typed arrays: its number
+    (which names its image file), its duration in seconds, and the ids of its
+    speaker and message. Speaker names and message texts are stored once and
+    shared by every frame that uses them, so duplicated messages and long
+    speaker blocks cost a few bytes per frame.
+    """
+    __slots__ = ('directory', 'numbers', 'durations', 'speaker_ids', 'message_ids',
+                 'speakers', 'messages', '_speaker_index', '_message_index')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.numbers = array('I')
+        self.durations = array('d')
+        self.speaker_ids = array('I')
+        self.message_ids = array('I')
+        self.speakers = []
+        self.messages = []
+        self._speaker_index = {}
+        self._message_index = {}
+
+    def _intern(self, values, index, value):
+        """Get the id of a value, adding it to the value list the first time it is seen"""
+        value_id = index.get(value)
+        if value_id is None:
+            value_id = index[value] = len(values)
+            values.append(value)
+        return value_id
+
+    def append(self, number, duration, speaker, message):
+        self.numbers.append(number)
+        self.durations.append(duration)
+        self.speaker_ids.append(self._intern(self.speakers, self._speaker_index, speaker))
+        self.message_ids.append(self._intern(self.messages, self._message_index, message))
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def filename(self, i):
+        return frame_filename(self.numbers[i])
+
+    def path(self, i):
+        return frame_path(self.directory, self.numbers[i])
+
+    def paths(self):
+        """Iterate over the image paths of all frames"""
+        for number in self.numbers:
+            yield frame_path(self.directory, number)
+
+    def speaker(self, i):
+        return self.speakers[self.speaker_ids[i]]
+
+    def message(self, i):
+        return self.messages[self.message_ids[i]]
@@ -2,186 +2,22 @@ import sys
 import os
 import datetime
 import subprocess
-from PIL import Image, ImageFont, ImageDraw 
-from pilmoji import Pilmoji
-from tabulate import tabulate
-import datetime, time
-import yaml
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+import threading
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel,
     QTextEdit, QLineEdit, QPushButton, QFileDialog, QMessageBox, QScrollArea,
-    QStackedWidget, QSizePolicy
+    QStackedWidget, QSizePolicy, QCheckBox, QProgressBar
 )
-from PyQt5.QtGui import QDoubleValidator, QIntValidator, QFont
+from PyQt5.QtGui import QDoubleValidator, QIntValidator, QFont, QImage, QPixmap
+import profiling
 from xml_builder import create_xml
-import re
+from renderer import save_images, render_preview, GenerationCancelled, CHAT_DIRECTORY, CONFIG_PATH, EXPORT_WORKERS
+from frame_cache import get_cached_start_time
+from script_parser import parse_script, Speaker, BlockBreak, ParseError
+from watcher import watch
 
 
-# ============================================================================
-# BACKEND FUNCTIONS
-# ============================================================================
-
-LOCAL_DIRECTORY = os.getcwd()
-
-# CONSTANTS
-WORLD_WIDTH = 1777
-WORLD_Y_INIT = 231
-WORLD_DY = 80
-
-WORLD_HEIGHTS = [WORLD_Y_INIT + i * WORLD_DY for i in range(5)]
-WORLD_COLOR = (54,57,63,255)
-
-PROFPIC_WIDTH = 120
-PROFPIC_POSITION = (36,45)
-
-NAME_FONT_SIZE = 50
-TIME_FONT_SIZE = 30
-MESSAGE_FONT_SIZE = 50
-NAME_FONT_COLOR = (255,255,255)
-TIME_FONT_COLOR = (180,180,180)
-MESSAGE_FONT_COLOR = (220,220,220)
-NAME_POSITION = (190,53)
-TIME_POSITION_Y = 67
-NAME_TIME_SPACING = 25
-MESSAGE_X = 190
-MESSAGE_Y_INIT = 130
-MESSAGE_DY = 80
-MESSAGE_POSITIONS = [(MESSAGE_X, MESSAGE_Y_INIT + i * MESSAGE_DY) for i in range(5)]
-
-# Mention highlighting constants
-MENTION_BG_COLOR = (61,66,113,255)  # 3c4270 with alpha
-MENTION_TEXT_COLOR = (201, 205, 251)  # c9cdfb
-MENTION_RADIUS = 5
-
-# APP badge constants
-APP_BADGE_HEIGHT = 45   # Increase this for a larger badge
-APP_BADGE_SPACING = 16  # Space between name and badge
-
-# Text fonts
-name_font = ImageFont.truetype(rf'{LOCAL_DIRECTORY}\fonts\ggsans-Semibold.ttf', NAME_FONT_SIZE)
-time_font = ImageFont.truetype(rf'{LOCAL_DIRECTORY}\fonts\ggsans-Medium.ttf', TIME_FONT_SIZE)
-message_font = ImageFont.truetype(rf'{LOCAL_DIRECTORY}\fonts\ggsans-Normal.ttf', MESSAGE_FONT_SIZE)
-
-# Load configurations from YAML
-with open('details.yaml') as file:
-    config = yaml.safe_load(file)
-
-def get_app_badge():
-    """Load and resize the APP badge"""
-    badge = Image.open('app_button.png')
-    # Calculate width to maintain aspect ratio
-    aspect_ratio = badge.width / badge.height
-    badge_width = int(APP_BADGE_HEIGHT * aspect_ratio)
-    return badge.resize((badge_width, APP_BADGE_HEIGHT), Image.Resampling.LANCZOS)
-
-def draw_mention(draw, position, text, font):
-    """Draw a mention with background and text"""
-    bbox = draw.textbbox(position, text, font=font)
-    
-    # Add padding to make the highlight slightly bigger
-    padding = 6  # Adjust this value for the desired highlight size
-    bbox = (bbox[0] - padding, bbox[1] - padding, bbox[2] + padding, bbox[3] + padding)
-    
-    # Draw rounded rectangle (mention highlight) around the text
-    draw.rounded_rectangle(bbox, radius=MENTION_RADIUS, fill=MENTION_BG_COLOR)
-    draw.text(position, text, fill=MENTION_TEXT_COLOR, font=font)
-
-# Load different font styles
-bold_font = ImageFont.truetype(rf'{LOCAL_DIRECTORY}\fonts\ggsans-Semibold.ttf', MESSAGE_FONT_SIZE)
-italic_font = ImageFont.truetype(rf'{LOCAL_DIRECTORY}\fonts\ggsans-NormalItalic.ttf', MESSAGE_FONT_SIZE)
-bold_italic_font = ImageFont.truetype(rf'{LOCAL_DIRECTORY}\fonts\ggsans-BoldItalic.ttf', MESSAGE_FONT_SIZE)
-monospace_font = ImageFont.truetype(rf'{LOCAL_DIRECTORY}\fonts\ggsans-Normal.ttf', MESSAGE_FONT_SIZE)  # Example monospace font
-
-# Function to apply Markdown text formatting
-def render_markdown_text(draw, position, text, font):
-    """Render markdown text with different styles"""
-    x, y = position
-    parts = re.split(r'(\*\*\*.*?\*\*\*|\*\*.*?\*\*|\*.*?\*|__.*?__|~~.*?~~|`.*?`)', text)
-
-    for part in parts:
-        if part.startswith("***") and part.endswith("***") or part.startswith("___") and part.endswith("___"):
-            font_to_use = bold_italic_font
-            clean_text = part[3:-3]
-        elif part.startswith("**") and part.endswith("**") or part.startswith("__") and part.endswith("__"):
-            font_to_use = bold_font
-            clean_text = part[2:-2]
-        elif part.startswith("*") and part.endswith("*") or part.startswith("_") and part.endswith("_"):
-            font_to_use = italic_font
-            clean_text = part[1:-1]
-        elif part.startswith("~~") and part.endswith("~~"):
-            font_to_use = font
-            clean_text = part[2:-2]
-        elif part.startswith("`") and part.endswith("`"):
-            font_to_use = monospace_font
-            clean_text = part[1:-1]
-        else:
-            font_to_use = font
-            clean_text = part
-
-        draw.text((x, y), clean_text, MESSAGE_FONT_COLOR, font=font_to_use)
-        x += font_to_use.getlength(clean_text)
-
-        # Strikethrough effect for ~~text~~
-        if part.startswith("~~") and part.endswith("~~"):
-            line_y = y + MESSAGE_FONT_SIZE // 2
-            draw.line((x - font_to_use.getlength(clean_text), line_y, x, line_y), fill=MESSAGE_FONT_COLOR, width=3)
-
-
-def generate_chat(messages, name, time, profpic_file, color, is_bot=False):
-    name_text = name
-    time_text = f'Today at {time} PM'
-    
-    # Load and prepare profile picture
-    prof_pic = Image.open(profpic_file)
-    prof_pic.thumbnail([sys.maxsize, PROFPIC_WIDTH], Image.Resampling.LANCZOS)
-    
-    # Create profile picture mask
-    mask = Image.new("L", prof_pic.size, 0)
-    draw = ImageDraw.Draw(mask)
-    draw.ellipse([(0, 0), (PROFPIC_WIDTH, PROFPIC_WIDTH)], fill=255)
-    
-    # Create template
-    template = Image.new(mode='RGBA', size=(WORLD_WIDTH, WORLD_HEIGHTS[len(messages)-1]), color=WORLD_COLOR)
-    template.paste(prof_pic, (36,45), mask)
-    template_editable = ImageDraw.Draw(template)
-    
-    # Draw name
-    template_editable.text(NAME_POSITION, name_text, color, font=name_font)
-    
-    # Calculate positions for APP badge and time
-    name_width = name_font.getlength(name)
-    current_x = NAME_POSITION[0] + name_width
-    
-    # If bot account, add APP badge
-    if is_bot:
-        current_x += APP_BADGE_SPACING
-        app_badge = get_app_badge()
-        badge_y = NAME_POSITION[1] + (NAME_FONT_SIZE - APP_BADGE_HEIGHT) // 2 + 5  # Adjusted to -8 for better centering
-        template.paste(app_badge, (int(current_x), badge_y), app_badge.convert('RGBA'))
-        current_x += app_badge.width
-    
-    # Draw time with updated position
-    time_position = (current_x + NAME_TIME_SPACING, TIME_POSITION_Y)
-    template_editable.text(time_position, time_text, TIME_FONT_COLOR, font=time_font)
-    
-    # Draw messages
-    for i, message in enumerate(messages):
-        with Pilmoji(template) as pilmoji:
-            # Split message into parts to handle mentions
-            parts = re.split(r'(@\w+)', message.strip())
-            x_offset = MESSAGE_POSITIONS[i][0]
-            y_offset = MESSAGE_POSITIONS[i][1]
-            for part in parts:
-                if part.startswith('@'):
-                    draw_mention(template_editable, (x_offset, y_offset), part, message_font)
-                    x_offset += message_font.getlength(part)
-                else:
-                    render_markdown_text(template_editable, (x_offset, y_offset), part, message_font)
-                    x_offset += message_font.getlength(part)
-            
-    return template
-
 def get_filename():
     root = Tk()
     root.withdraw()
@@ -189,86 +25,135 @@ def get_filename():
     return filedialog.askopenfilename()
 
 
-def save_images(lines, init_time, nums_to_skip, dt=30):
-    if not os.path.exists('chat'):
-        os.makedirs('chat')
-    
-    name_up_next = True
-    current_time = init_time
-    current_name = None
-    current_lines = []
-    msg_number = 1
-
-    image_durations = {}
-    
-    for line in lines:
-        if line == '':
-            name_up_next = True
-            current_lines = []
-            continue
-        
-        if line[0] == '#':
-            continue
-        
-        if name_up_next:
-            current_name = line.split(':')[0]
-            name_up_next = False
-            continue
-        
-        # Handle message duplication
-        message_parts = line.split('$^')
-        message = message_parts[0]
-        delay = float(message_parts[1].split('$')[0]) if len(message_parts) > 1 else 1.0
-        duplication = int(message_parts[1].split('$x')[1]) if len(message_parts) > 1 and 'x' in message_parts[1] else 1
-        
-        for i in range(duplication):
-            # Calculate exponential decrease with minimum duration
-            adjusted_delay = delay / (2 ** i)
-            adjusted_delay = max(adjusted_delay, 0.2)  # Minimum duration of 0.2 seconds
-            
-            current_lines.append(message)
-            image = generate_chat(
-                messages=current_lines,
-                name=current_name,
-                time=f'{current_time.hour % 12}:{current_time.minute}',
-                profpic_file=f'profile_pictures/{config[current_name]["dp"]}',
-                color=tuple(int(config[current_name].get("color", "FFFFFF")[i:i+2], 16) for i in (0, 2, 4)),
-                is_bot=config[current_name].get("bot", False)
-            )
-            
-            while f'{msg_number:03d}' in nums_to_skip:
-                print(f'found {msg_number:03d}')
-                msg_number += 1
-                    
-            image.save(rf'{LOCAL_DIRECTORY}\chat\{msg_number:03d}.png')
-            image_durations[rf'{LOCAL_DIRECTORY}\chat\{msg_number:03d}.png'] = adjusted_delay
-            
-            current_time += datetime.timedelta(0,dt)
-            msg_number += 1
-
-    return image_durations
-
 # ============================================================================
-# GENERATION THREAD (Runs backend processing in the background)
+# GENERATION THREADS (Run backend processing in the background)
 # ============================================================================
+def generate(file_path, progress=None, cancel_event=None, conversation=False, keep_timestamps=False):
+    """Render the frames and XML of a script, returns the XML path and a summary of where the time went"""
+    profiling.reset()
+    current_time = datetime.datetime.now()
+    if keep_timestamps:
+        # Reuse the timestamps of the last run of this script, so unchanged frames come from the cache
+        current_time = get_cached_start_time(CHAT_DIRECTORY, file_path) or current_time
+    nums_array = []  # No file numbers to skip in the GUI
+    with open(file_path, encoding="utf8") as f:
+        frames = save_images(f, init_time=current_time, nums_to_skip=nums_array, workers=EXPORT_WORKERS, script_path=file_path, progress=progress, cancel_event=cancel_event, conversation=conversation)
+    create_xml(frames)
+    print(profiling.format_report())
+    return os.path.abspath("output.xml"), profiling.format_summary()
+
 class GenerationThread(QThread):
     finished = pyqtSignal(str)
     error = pyqtSignal(str)
-    def __init__(self, file_path):
+    # Frames done and total, frames per second and estimated seconds left (negative when unknown)
+    progress = pyqtSignal(int, int, float, float)
+    cancelled = pyqtSignal(str)
+    def __init__(self, file_path, conversation=False, keep_timestamps=False):
         super().__init__()
         self.file_path = file_path
+        self.conversation = conversation
+        self.keep_timestamps = keep_timestamps
+        self.profile_summary = ""
+        self.cancel_event = threading.Event()
     def run(self):
         try:
-            with open(self.file_path, encoding="utf8") as f:
-                lines = f.read().splitlines()
-            current_time = datetime.datetime.now()
-            nums_array = []  # No file numbers to skip in the GUI
-            image_durations = save_images(lines, init_time=current_time, nums_to_skip=nums_array)
-            create_xml(image_durations)
-            xml_path = os.path.abspath("output.xml")
+            xml_path, self.profile_summary = generate(self.file_path, self.reportProgress, self.cancel_event, self.conversation, self.keep_timestamps)
             self.finished.emit(xml_path)
+        except GenerationCancelled as e:
+            self.cancelled.emit(str(e))
         except Exception as e:
             self.error.emit(str(e))
+    def reportProgress(self, progress):
+        eta_seconds = -1.0 if progress.eta_seconds is None else progress.eta_seconds
+        self.progress.emit(progress.done, progress.total, progress.frames_per_second, eta_seconds)
+    def cancel(self):
+        """Stop after the frame being rendered, the frames already rendered are reused by a run keeping the same timestamps"""
+        self.cancel_event.set()
+
+def format_progress(done, total, frames_per_second, eta_seconds):
+    """Describe the progress of a generation, e.g. for a status label"""
+    text = f"Rendering frames: {done}/{total} ({frames_per_second:.1f} frames/s"
+    if eta_seconds >= 0:
+        minutes, seconds = divmod(round(eta_seconds), 60)
+        text += f", {minutes}:{seconds:02d} left"
+    return text + ")"
+
+class PreviewThread(QThread):
+    """Renders low resolution frame previews in the background, always the most recently requested one"""
+    rendered = pyqtSignal(QImage)
+    def __init__(self):
+        super().__init__()
+        self.request = None
+        self.wake = threading.Event()
+        self.stopped = False
+    def request_preview(self, lines, line_number=None):
+        """Ask for a preview of the script lines, replacing any request not rendered yet"""
+        self.request = (lines, line_number)
+        self.wake.set()
+    def run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            if self.stopped:
+                return
+            lines, line_number = self.request
+            try:
+                # Previews run during generations, keep them out of their timing report
+                with profiling.disabled():
+                    image = render_preview(lines, line_number)
+            except Exception:
+                # Unknown speaker or script being typed, nothing to show yet
+                image = None
+            self.rendered.emit(to_qimage(image) if image is not None else QImage())
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
+        self.wait()
+
+def to_qimage(image):
+    """Convert a PIL image to a QImage"""
+    image = image.convert("RGBA")
+    data = image.tobytes("raw", "RGBA")
+    return QImage(data, image.width, image.height, image.width * 4, QImage.Format_RGBA8888).copy()
+
+def show_preview(label, qimage):
+    """Show a rendered preview in a label, or clear it when there is nothing to show"""
+    if qimage.isNull():
+        label.clear()
+    else:
+        label.setPixmap(QPixmap.fromImage(qimage))
+
+# Milliseconds without changes before a preview is rendered
+PREVIEW_DEBOUNCE_MS = 150
+
+class WatchThread(QThread):
+    """Generates the script again every time it or the speaker configuration is saved"""
+    generating = pyqtSignal()
+    # The XML path and the profile summary of the run, sent together as the thread may be gone by the time they are shown
+    finished = pyqtSignal(str, str)
+    error = pyqtSignal(str)
+    def __init__(self, file_path, conversation=False):
+        super().__init__()
+        self.file_path = file_path
+        self.conversation = conversation
+        self.stop_event = threading.Event()
+    def run(self):
+        watch([self.file_path, CONFIG_PATH], self.regenerate, self.stop_event)
+    def regenerate(self):
+        self.generating.emit()
+        try:
+            # Edits keep the timestamps of the previous run, so only the frames they changed are rendered
+            xml_path, profile_summary = generate(self.file_path, cancel_event=self.stop_event, conversation=self.conversation, keep_timestamps=True)
+            self.finished.emit(xml_path, profile_summary)
+        except GenerationCancelled:
+            # Stopped watching, the frames already rendered are kept for the next run
+            pass
+        except Exception as e:
+            self.error.emit(str(e))
+    def stop(self):
+        """Stop watching, a generation in progress stops after the frame being rendered"""
+        self.stop_event.set()
+        self.wait()
 
 # ============================================================================
 # DRAG & DROP LABEL (Home page file drop area)
@@ -299,22 +184,25 @@ class DragDropLabel(QLabel):
 # ============================================================================
 # FORMAT PREVIEW TEXT (For the Home page file preview)
 # ============================================================================
-def format_preview_text(raw_text):
-    lines = raw_text.splitlines()
+def format_preview_text(lines, line_numbers=None):
+    """Format a script as HTML, filling line_numbers (if given) with the script line number of every shown line"""
     html_lines = []
-    for line in lines:
-        stripped = line.strip()
-        if not stripped:
+    shown = [] if line_numbers is None else line_numbers
+    for event in parse_script(lines):
+        if isinstance(event, BlockBreak):
             html_lines.append("<br>")
-        elif stripped.startswith("#"):
-            continue
-        elif stripped.endswith(":"):
-            name = stripped[:-1].strip()
-            html_lines.append(f'<span style="font-weight:bold; color:#888888;">{name} :</span><br><br>')
+            shown.append(event.line_number)
+        elif isinstance(event, Speaker):
+            html_lines.append(f'<span style="font-weight:bold; color:#888888;">{event.name} :</span><br><br>')
+            shown.extend([event.line_number] * 2)
+        elif isinstance(event, ParseError):
+            html_lines.append(f'<span style="color:#ff5555;">Line {event.line_number}: {event.error}</span><br>')
+            shown.append(event.line_number)
         else:
-            filtered = line.split('$')[0].strip()
+            filtered = event.text.strip()
             if filtered:
                 html_lines.append(filtered + "<br>")
+                shown.append(event.line_number)
     return ''.join(html_lines)
 
 # ============================================================================
@@ -325,6 +213,7 @@ class HomePage(QWidget):
         super().__init__()
         self.switch_to_script_writer_callback = switch_to_script_writer_callback
         self.current_file = None
+        self.thread = None
         layout = QVBoxLayout(self)
         layout.setSpacing(15)
         layout.setContentsMargins(20, 20, 20, 20)
@@ -356,16 +245,46 @@ class HomePage(QWidget):
         layout.addWidget(self.fileInfoLabel)
         self.filePreview = QTextEdit()
         self.filePreview.setReadOnly(True)
+        self.filePreview.cursorPositionChanged.connect(self.schedulePreview)
         layout.addWidget(self.filePreview, stretch=1)
 
+        # Low resolution render of the block under the cursor (the last block by default)
+        self.framePreview = QLabel()
+        self.framePreview.setAlignment(Qt.AlignCenter)
+        layout.addWidget(self.framePreview)
+        self.script_lines = []
+        self.preview_line_numbers = []
+        self.previewThread = PreviewThread()
+        self.previewThread.rendered.connect(lambda qimage: show_preview(self.framePreview, qimage))
+        self.previewThread.start()
+        self.previewTimer = QTimer(self)
+        self.previewTimer.setSingleShot(True)
+        self.previewTimer.setInterval(PREVIEW_DEBOUNCE_MS)
+        self.previewTimer.timeout.connect(self.requestPreview)
+
         # Generate Button and Status
         self.generateButton = QPushButton("Generate")
         self.generateButton.setFixedHeight(50)
         self.generateButton.setStyleSheet("border-radius: 25px; font-size: 16px;")
         self.generateButton.clicked.connect(self.generateProcess)
         layout.addWidget(self.generateButton)
+        self.conversationCheckBox = QCheckBox("Conversation mode (show the whole conversation so far in every frame)")
+        layout.addWidget(self.conversationCheckBox)
+        self.keepTimestampsCheckBox = QCheckBox("Keep the timestamps of the last run (only render the frames that changed)")
+        layout.addWidget(self.keepTimestampsCheckBox)
+        self.watchCheckBox = QCheckBox("Watch for changes (generate again every time the script is saved)")
+        self.watchCheckBox.toggled.connect(self.toggleWatch)
+        layout.addWidget(self.watchCheckBox)
+        self.watchThread = None
         self.statusLabel = QLabel("")
         layout.addWidget(self.statusLabel)
+        self.progressBar = QProgressBar()
+        self.progressBar.setVisible(False)
+        layout.addWidget(self.progressBar)
+        self.cancelButton = QPushButton("Cancel")
+        self.cancelButton.setVisible(False)
+        self.cancelButton.clicked.connect(self.cancelGeneration)
+        layout.addWidget(self.cancelButton)
         self.showMeButton = QPushButton("Show me")
         self.showMeButton.setVisible(False)
         self.showMeButton.clicked.connect(self.showXML)
@@ -387,16 +306,40 @@ class HomePage(QWidget):
 
     def loadFile(self, file_path):
         self.current_file = file_path
+        self.refreshPreview()
+        if self.watchThread is not None:
+            # Watch the new file instead
+            self.startWatching()
+
+    def refreshPreview(self):
+        file_path = self.current_file
         mod_time = datetime.datetime.fromtimestamp(os.path.getmtime(file_path))
         mod_time_str = mod_time.strftime("%Y-%m-%d %H:%M:%S")
         self.fileInfoLabel.setText(f"File: {os.path.basename(file_path)}  |  Last Modified: {mod_time_str}")
         try:
             with open(file_path, "r", encoding="utf8") as f:
-                content = f.read()
-            formatted_content = format_preview_text(content)
+                self.script_lines = f.read().splitlines()
+            self.preview_line_numbers = []
+            formatted_content = format_preview_text(self.script_lines, self.preview_line_numbers)
             self.filePreview.setHtml(formatted_content)
         except Exception as e:
+            self.script_lines = []
             self.filePreview.setPlainText(f"Error loading file: {e}")
+        self.schedulePreview()
+
+    def schedulePreview(self):
+        # Restarts the timer, so moving the cursor around only renders where it stops
+        self.previewTimer.start()
+
+    def requestPreview(self):
+        line_number = None
+        if self.filePreview.hasFocus():
+            # Preview the block of the line under the cursor
+            position = self.filePreview.textCursor().position()
+            shown_line = self.filePreview.toPlainText()[:position].count("\n")
+            if shown_line < len(self.preview_line_numbers):
+                line_number = self.preview_line_numbers[shown_line]
+        self.previewThread.request_preview(self.script_lines, line_number)
 
     def fileDropped(self, file_path):
         self.loadFile(file_path)
@@ -411,21 +354,87 @@ class HomePage(QWidget):
             QMessageBox.warning(self, "No File Selected", "Please select a script file first.")
             return
         self.generateButton.setEnabled(False)
+        self.watchCheckBox.setEnabled(False)
         self.statusLabel.setText("Processing...")
-        self.thread = GenerationThread(self.current_file)
+        self.progressBar.setValue(0)
+        self.progressBar.setVisible(True)
+        self.cancelButton.setEnabled(True)
+        self.cancelButton.setVisible(True)
+        self.thread = GenerationThread(self.current_file, self.conversationCheckBox.isChecked(), self.keepTimestampsCheckBox.isChecked())
         self.thread.finished.connect(self.generationFinished)
         self.thread.error.connect(self.generationError)
+        self.thread.progress.connect(self.generationProgress)
+        self.thread.cancelled.connect(self.generationCancelled)
         self.thread.start()
 
+    def generationProgress(self, done, total, frames_per_second, eta_seconds):
+        self.progressBar.setMaximum(total)
+        self.progressBar.setValue(done)
+        self.statusLabel.setText(format_progress(done, total, frames_per_second, eta_seconds))
+
+    def cancelGeneration(self):
+        self.cancelButton.setEnabled(False)
+        self.statusLabel.setText("Cancelling...")
+        self.thread.cancel()
+
+    def generationEnded(self):
+        self.generateButton.setEnabled(True)
+        self.watchCheckBox.setEnabled(True)
+        self.progressBar.setVisible(False)
+        self.cancelButton.setVisible(False)
+
     def generationFinished(self, xml_path):
-        self.statusLabel.setText("XML file successfully created!")
+        self.statusLabel.setText(f"XML file successfully created! ({self.thread.profile_summary})")
         self.generated_xml_path = xml_path
-        self.generateButton.setEnabled(True)
+        self.generationEnded()
         self.showMeButton.setVisible(True)
 
     def generationError(self, error_msg):
         self.statusLabel.setText(f"Error: {error_msg}")
-        self.generateButton.setEnabled(True)
+        self.generationEnded()
+
+    def generationCancelled(self, message):
+        # Frame keys include the time, so only a run with the same timestamps picks up where this one stopped
+        self.keepTimestampsCheckBox.setChecked(True)
+        self.statusLabel.setText(f"{message}, generating again keeps the timestamps and reuses them")
+        self.generationEnded()
+
+    def toggleWatch(self, checked):
+        if checked:
+            if not self.current_file:
+                QMessageBox.warning(self, "No File Selected", "Please select a script file first.")
+                self.watchCheckBox.setChecked(False)
+                return
+            self.startWatching()
+            self.statusLabel.setText(f"Watching {os.path.basename(self.current_file)} for changes...")
+        else:
+            self.stopWatching()
+            self.statusLabel.setText("")
+        # Generating by hand would race with the watcher
+        self.generateButton.setEnabled(not checked)
+
+    def startWatching(self):
+        self.stopWatching()
+        self.watchThread = WatchThread(self.current_file, self.conversationCheckBox.isChecked())
+        self.watchThread.generating.connect(lambda: self.statusLabel.setText("Script changed, processing..."))
+        self.watchThread.finished.connect(self.watchGenerationFinished)
+        self.watchThread.error.connect(self.watchGenerationError)
+        self.watchThread.start()
+
+    def stopWatching(self):
+        if self.watchThread is not None:
+            self.watchThread.stop()
+            self.watchThread = None
+
+    def watchGenerationFinished(self, xml_path, profile_summary):
+        now = datetime.datetime.now().strftime("%H:%M:%S")
+        self.statusLabel.setText(f"XML file updated at {now}! ({profile_summary})")
+        self.generated_xml_path = xml_path
+        self.showMeButton.setVisible(True)
+        self.refreshPreview()
+
+    def watchGenerationError(self, error_msg):
+        self.statusLabel.setText(f"Error: {error_msg} (still watching for changes)")
 
     def showXML(self):
         if hasattr(self, 'generated_xml_path') and os.path.exists(self.generated_xml_path):
@@ -447,6 +456,7 @@ class HomePage(QWidget):
 class MessageRowWidget(QWidget):
     addAfter = pyqtSignal()
     removeRow = pyqtSignal()
+    changed = pyqtSignal()
     def __init__(self):
         super().__init__()
         layout = QHBoxLayout(self)
@@ -461,6 +471,7 @@ class MessageRowWidget(QWidget):
         font.setPointSize(14)
         self.msg_text.setFont(font)
         self.msg_text.setStyleSheet("background-color: #3b3b3b; color: white; padding: 5px;")
+        self.msg_text.textChanged.connect(self.changed.emit)
         layout.addWidget(self.msg_text, stretch=1)
         
         # Delay field with QDoubleValidator (allows numbers and decimal points)
@@ -473,6 +484,7 @@ class MessageRowWidget(QWidget):
         font_time = QFont()
         font_time.setPointSize(14)
         self.time_edit.setFont(font_time)
+        self.time_edit.textChanged.connect(self.changed.emit)
         layout.addWidget(self.time_edit)
         
         # Duplication field with QIntValidator (numbers only)
@@ -485,6 +497,7 @@ class MessageRowWidget(QWidget):
         font_dup = QFont()
         font_dup.setPointSize(14)
         self.dup_edit.setFont(font_dup)
+        self.dup_edit.textChanged.connect(self.changed.emit)
         layout.addWidget(self.dup_edit)
         
         # Plus button
@@ -519,6 +532,7 @@ class MessageRowWidget(QWidget):
 # ============================================================================
 class UserBlockWidget(QWidget):
     removed = pyqtSignal(QWidget)
+    changed = pyqtSignal(QWidget)
     def __init__(self):
         super().__init__()
         self.message_rows = []
@@ -535,6 +549,7 @@ class UserBlockWidget(QWidget):
         font.setPointSize(16)
         self.username_edit.setFont(font)
         self.username_edit.setStyleSheet("background-color: #3b3b3b; color: white; padding: 5px;")
+        self.username_edit.textChanged.connect(lambda: self.changed.emit(self))
         header_layout.addWidget(self.username_edit)
         remove_button = QPushButton("✖")
         remove_button.setStyleSheet("color: red; font-size: 16px;")
@@ -554,6 +569,7 @@ class UserBlockWidget(QWidget):
         msg_row = MessageRowWidget()
         msg_row.addAfter.connect(lambda: self.insert_message_row_after(msg_row))
         msg_row.removeRow.connect(lambda: self.remove_message_row(msg_row))
+        msg_row.changed.connect(lambda: self.changed.emit(self))
         if index is None:
             self.message_rows.append(msg_row)
             self.msg_layout.addWidget(msg_row)
@@ -574,6 +590,7 @@ class UserBlockWidget(QWidget):
         msg_row.setParent(None)
         msg_row.deleteLater()
         self._refresh_message_rows()
+        self.changed.emit(self)
     
     def _refresh_message_rows(self):
         while self.msg_layout.count():
@@ -651,6 +668,19 @@ class ScriptWriterPage(QWidget):
         self.scroll_area.setWidget(self.scroll_content)
         main_layout.addWidget(self.scroll_area, stretch=1)
         
+        # Low resolution render of the block being edited
+        self.framePreview = QLabel()
+        self.framePreview.setAlignment(Qt.AlignCenter)
+        main_layout.addWidget(self.framePreview)
+        self.preview_block = None
+        self.previewThread = PreviewThread()
+        self.previewThread.rendered.connect(lambda qimage: show_preview(self.framePreview, qimage))
+        self.previewThread.start()
+        self.previewTimer = QTimer(self)
+        self.previewTimer.setSingleShot(True)
+        self.previewTimer.setInterval(PREVIEW_DEBOUNCE_MS)
+        self.previewTimer.timeout.connect(self.request_preview)
+        
         # Generate Script Button
         generate_button = QPushButton("Generate Script")
         generate_button.setFixedHeight(40)
@@ -664,6 +694,7 @@ class ScriptWriterPage(QWidget):
     def add_user_block(self):
         user_block = UserBlockWidget()
         user_block.removed.connect(self.remove_user_block)
+        user_block.changed.connect(self.schedule_preview)
         self.user_blocks.append(user_block)
         self.scroll_layout.addWidget(user_block)
     
@@ -671,6 +702,18 @@ class ScriptWriterPage(QWidget):
         self.user_blocks.remove(user_block)
         user_block.setParent(None)
         user_block.deleteLater()
+        if self.preview_block is user_block:
+            self.preview_block = None
+            self.framePreview.clear()
+    
+    def schedule_preview(self, user_block):
+        # Restarts the timer, so the preview is rendered once typing pauses
+        self.preview_block = user_block
+        self.previewTimer.start()
+    
+    def request_preview(self):
+        if self.preview_block is not None:
+            self.previewThread.request_preview(self.preview_block.get_script_text().splitlines())
     
     def generate_script(self):
         script = ""
@@ -719,6 +762,14 @@ class AppWindow(QMainWindow):
         self.stack.setCurrentWidget(self.script_writer_page)
     def switch_to_home_page(self):
         self.stack.setCurrentWidget(self.home_page)
+    def closeEvent(self, event):
+        if self.home_page.thread is not None:
+            self.home_page.thread.cancel()
+            self.home_page.thread.wait()
+        self.home_page.stopWatching()
+        self.home_page.previewThread.stop()
+        self.script_writer_page.previewThread.stop()
+        super().closeEvent(event)
 
 # ============================================================================
 # APPLICATION ENTRY POINT
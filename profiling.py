@@ -0,0 +1,130 @@
+"""
+Timing instrumentation of generation runs.
+
+Stages of the pipeline are timed with the stage context manager or the
+timed decorator, which record every call as a (start, seconds, pid) sample
+under the stage name. Stages can be nested, a stage's time includes that of
+the stages called inside it. Samples are kept per process: worker processes
+send theirs back with take_samples and the main process adds them with
+merge_samples. Threads doing work that is not part of the run, such as the
+GUI's live previews, stop recording with disabled.
+At the end of a run, format_report gives a count, total, p50 and p95 per
+stage, and write_trace saves every sample as a JSON trace that can be
+opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+import collections
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# Samples of every stage of this process, by stage name
+samples = collections.defaultdict(list)
+
+# Per thread state, whether recording is disabled in the thread
+local = threading.local()
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the code in the with block as one call of a stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if not getattr(local, 'disabled', False):
+            samples[name].append((start, time.perf_counter() - start, os.getpid()))
+
+
+def timed(name):
+    """Decorator timing every call of a function as a stage"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if not getattr(local, 'disabled', False):
+                    samples[name].append((start, time.perf_counter() - start, os.getpid()))
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def disabled():
+    """Don't record the stages called in the with block, in this thread only"""
+    local.disabled = True
+    try:
+        yield
+    finally:
+        local.disabled = False
+
+
+def reset():
+    """Forget the samples of previous runs"""
+    samples.clear()
+
+
+def take_samples():
+    """Get the samples of this process and forget them, to send them back from a worker"""
+    taken = dict(samples)
+    samples.clear()
+    return taken
+
+
+def merge_samples(taken):
+    """Add the samples taken in another process (or taken earlier) to this process's"""
+    for name, stage_samples in taken.items():
+        samples[name].extend(stage_samples)
+
+
+def percentile(sorted_values, fraction):
+    """Get a percentile of sorted values, by the nearest rank"""
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize():
+    """Get the (stage, count, total, p50, p95) of every stage in seconds, slowest stage first"""
+    rows = []
+    for name, stage_samples in samples.items():
+        durations = sorted(sample[1] for sample in stage_samples)
+        rows.append((name, len(durations), sum(durations), percentile(durations, 0.5), percentile(durations, 0.95)))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows
+
+
+def format_report():
+    """Format a table of the time spent in every stage"""
+    rows = [('Stage', 'Count', 'Total (ms)', 'p50 (ms)', 'p95 (ms)')]
+    for name, count, total, p50, p95 in summarize():
+        rows.append((name, str(count), f'{total * 1e3:.1f}', f'{p50 * 1e3:.2f}', f'{p95 * 1e3:.2f}'))
+
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    lines = []
+    for i, row in enumerate(rows):
+        cells = [cell.ljust(width) if column == 0 else cell.rjust(width) for column, (cell, width) in enumerate(zip(row, widths))]
+        lines.append('  '.join(cells))
+        if i == 0:
+            lines.append('  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+def format_summary(stages=3):
+    """Summarise the slowest stages on one line, e.g. for a status label"""
+    return ', '.join(f'{name} {total:.2f}s' for name, count, total, p50, p95 in summarize()[:stages])
+
+
+def write_trace(path):
+    """Save every sample as a Chrome trace event file"""
+    events = [
+        {'name': name, 'ph': 'X', 'ts': round(start * 1e6), 'dur': round(seconds * 1e6), 'pid': pid, 'tid': 0}
+        for name, stage_samples in samples.items()
+        for start, seconds, pid in stage_samples
+    ]
+    events.sort(key=lambda event: event['ts'])
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
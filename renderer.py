@@ -0,0 +1,1113 @@
+import sys
+import os
+import datetime
+import concurrent.futures
+import collections
+import functools
+import re
+import threading
+import time
+from PIL import Image, ImageDraw
+import yaml
+import profiling
+from font_registry import FontRegistry
+from frames import FrameTable, frame_path, frame_filename
+from frame_cache import load_manifest, save_manifest, hash_inputs, file_fingerprint, is_cached, record_frame, relocate_frames
+from sinks import PngSink, PNG_PROFILES
+from script_parser import parse_script, Speaker, Message, ParseError, ScriptParseError
+from emoji_set import get_emoji_path
+
+# Rendering backend, kept free of GUI imports so it can run headless (see cli.py).
+# Pilmoji is only imported once emoji actually need to be handled.
+
+
+# ============================================================================
+# BACKEND FUNCTIONS
+# ============================================================================
+
+LOCAL_DIRECTORY = os.getcwd()
+CHAT_DIRECTORY = os.path.join(LOCAL_DIRECTORY, 'chat')
+
+# CONSTANTS
+WORLD_WIDTH = 1777
+# Space left below the last message row
+WORLD_BOTTOM_MARGIN = 21
+WORLD_COLOR = (54,57,63,255)
+
+PROFPIC_WIDTH = 120
+PROFPIC_POSITION = (36,45)
+
+# Header strip holds everything above the messages, down to the bottom of the profile picture
+HEADER_HEIGHT = PROFPIC_POSITION[1] + PROFPIC_WIDTH
+HEADER_CACHE_SIZE = 32
+
+NAME_FONT_SIZE = 50
+TIME_FONT_SIZE = 30
+MESSAGE_FONT_SIZE = 50
+NAME_FONT_COLOR = (255,255,255)
+TIME_FONT_COLOR = (180,180,180)
+MESSAGE_FONT_COLOR = (220,220,220)
+NAME_POSITION = (190,53)
+TIME_POSITION_Y = 67
+NAME_TIME_SPACING = 25
+MESSAGE_X = 190
+# Top of the capital letters of the first message row, rows are placed
+# from the message font's metrics so they follow its size
+MESSAGE_TEXT_TOP = 147
+# Space between message rows, on top of the message font's line height
+MESSAGE_ROW_SPACING = 13
+# Messages wrap to this width
+MESSAGE_WIDTH = WORLD_WIDTH - MESSAGE_X - 40
+
+# Mention highlighting constants
+MENTION_BG_COLOR = (61,66,113,255)  # 3c4270 with alpha
+MENTION_TEXT_COLOR = (201, 205, 251)  # c9cdfb
+MENTION_RADIUS = 5
+
+# Bump when the drawing code changes, so cached frames are rendered again
+RENDER_VERSION = 2
+
+# Text run cache constants, glyph masks are kept up to TEXT_RUN_CACHE_BYTES
+# per process, counting TEXT_RUN_OVERHEAD bytes for the rest of an entry
+TEXT_RUN_CACHE_SIZE = 4096
+TEXT_RUN_CACHE_BYTES = 32 * 1024 * 1024
+TEXT_RUN_OVERHEAD = 512
+TEXT_RUN_PADDING = 2
+
+# Message layout cache constants
+LAYOUT_CACHE_SIZE = 4096
+
+# Inline emoji constants
+EMOJI_MARGIN = 2
+EMOJI_CACHE_SIZE = 512
+
+# APP badge constants
+APP_BADGE_HEIGHT = 45   # Increase this for a larger badge
+APP_BADGE_SPACING = 16  # Space between name and badge
+
+# Text fonts, loaded on first use
+fonts = FontRegistry({
+    'name': ('ggsans-Semibold.ttf', NAME_FONT_SIZE),
+    'time': ('ggsans-Medium.ttf', TIME_FONT_SIZE),
+    'message': ('ggsans-Normal.ttf', MESSAGE_FONT_SIZE),
+    'bold': ('ggsans-Semibold.ttf', MESSAGE_FONT_SIZE),
+    'italic': ('ggsans-NormalItalic.ttf', MESSAGE_FONT_SIZE),
+    'bold_italic': ('ggsans-BoldItalic.ttf', MESSAGE_FONT_SIZE),
+    'monospace': ('ggsans-Normal.ttf', MESSAGE_FONT_SIZE),  # Example monospace font
+})
+
+# Number of processes used to export frames in parallel
+EXPORT_WORKERS = os.cpu_count() or 1
+
+# How frame images are encoded, one of sinks.PNG_PROFILES
+PNG_PROFILE = 'default'
+
+# Live previews are shown at 1/PREVIEW_REDUCE of the frame size, with the last PREVIEW_ROWS messages of the block
+PREVIEW_REDUCE = 4
+PREVIEW_ROWS = 5
+
+# Frames of conversation mode show the bottom CONVERSATION_HEIGHT pixels of the whole conversation
+CONVERSATION_HEIGHT = 1500
+
+# Seconds between two checks for cancellation while blocks render on a process pool
+CANCEL_POLL_INTERVAL = 0.1
+
+# Progress of save_images, reported after every frame (every block when exporting in parallel)
+Progress = collections.namedtuple('Progress', 'done total frames_per_second eta_seconds')
+
+
+class GenerationCancelled(Exception):
+    """Raised by save_images when it was cancelled, once the frames already rendered are recorded"""
+
+# Styles of message text, resizing message text resizes all of them
+MESSAGE_STYLES = ('message', 'bold', 'italic', 'bold_italic', 'monospace')
+
+def set_font_size(style, size):
+    """Change the size of a font style, the message style also sets the size of its markdown styles"""
+    for resized in MESSAGE_STYLES if style == 'message' else (style,):
+        fonts.set_size(resized, size)
+
+def set_font_styles(styles):
+    """Set the (file, size) of font styles"""
+    fonts.update(styles)
+
+def init_worker(font_styles):
+    """Set up a worker process with the fonts of the main process, and without the timing samples it inherited"""
+    profiling.reset()
+    set_font_styles(font_styles)
+
+# Speaker configuration
+CONFIG_PATH = 'details.yaml'
+
+# Prepared images, keyed by asset, along with the mtime of the file they were built from
+asset_cache = {}
+
+def get_cached_asset(key, path, loader):
+    """Return a prepared asset, only running the loader again when the file changes on disk"""
+    mtime = os.path.getmtime(path)
+    cached = asset_cache.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, loader(path))
+        asset_cache[key] = cached
+    return cached[1]
+
+def load_config(path):
+    """Load configurations from YAML"""
+    with open(path) as file:
+        return yaml.safe_load(file)
+
+def get_config():
+    """Get the speaker configuration, reloaded whenever the file changes"""
+    return get_cached_asset('config', CONFIG_PATH, load_config)
+
+def load_app_badge(path):
+    """Load and resize the APP badge"""
+    badge = Image.open(path)
+    # Calculate width to maintain aspect ratio
+    aspect_ratio = badge.width / badge.height
+    badge_width = int(APP_BADGE_HEIGHT * aspect_ratio)
+    return badge.resize((badge_width, APP_BADGE_HEIGHT), Image.Resampling.LANCZOS).convert('RGBA')
+
+def get_app_badge():
+    """Get the resized APP badge"""
+    return get_cached_asset('app_badge', 'app_button.png', load_app_badge)
+
+@profiling.timed('avatar')
+def load_profile_picture(path):
+    """Load and shrink a profile picture, returns it along with its circular mask"""
+    prof_pic = Image.open(path)
+    prof_pic.thumbnail([sys.maxsize, PROFPIC_WIDTH], Image.Resampling.LANCZOS)
+    
+    # Create profile picture mask
+    mask = Image.new("L", prof_pic.size, 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse([(0, 0), (PROFPIC_WIDTH, PROFPIC_WIDTH)], fill=255)
+    return prof_pic, mask
+
+def get_profile_picture(profpic_file):
+    """Get the prepared profile picture and mask for a speaker"""
+    return get_cached_asset(('profile_picture', profpic_file), profpic_file, load_profile_picture)
+
+class EmojiDraw(ImageDraw.ImageDraw):
+    """Drawing context for a frame that keeps hold of its image, so emoji can be composited inline"""
+    def __init__(self, image):
+        super().__init__(image)
+        self.image = image
+
+@functools.lru_cache(maxsize=None)
+def get_emoji_source():
+    """Get the local emoji source, emoji images never come from the network"""
+    from emoji_source import LocalEmojiSource
+    return LocalEmojiSource()
+
+@functools.lru_cache(maxsize=None)
+def get_emoji_regex():
+    """Get Pilmoji's emoji pattern, only imported when needed as building it takes a while"""
+    from pilmoji.helpers import EMOJI_REGEX
+    return EMOJI_REGEX
+
+@functools.lru_cache(maxsize=TEXT_RUN_CACHE_SIZE)
+def split_emoji(text):
+    """Split text into (is_emoji, content) runs"""
+    # Plain ASCII text can only hold custom Discord emoji (<:name:id>)
+    if text.isascii() and '<' not in text:
+        return ((False, text),) if text else ()
+    return tuple((i % 2 == 1, chunk) for i, chunk in enumerate(get_emoji_regex().split(text)) if chunk)
+
+@functools.lru_cache(maxsize=EMOJI_CACHE_SIZE)
+@profiling.timed('emoji')
+def get_sized_emoji(emoji, size):
+    """Get an emoji scaled to the font size, or None when the emoji set has no image for it"""
+    if emoji.startswith('<'):
+        # Custom Discord emoji, <:name:id>
+        image = get_emoji_source().get_discord_emoji_image(emoji.split(':')[-1][:-1])
+    else:
+        image = get_emoji_source().get_emoji_image(emoji)
+    if image is None:
+        return None
+    return image.resize((size, size), Image.Resampling.LANCZOS)
+
+@functools.lru_cache(maxsize=TEXT_RUN_CACHE_SIZE)
+def get_text_length(text, font):
+    """Get the advance width of a run of text, including any emoji in it"""
+    length = 0
+    for is_emoji, content in split_emoji(text):
+        emoji_image = get_sized_emoji(content, font.size) if is_emoji else None
+        if emoji_image is not None:
+            length += emoji_image.width + 2 * EMOJI_MARGIN
+        else:
+            length += font.getlength(content)
+    return length
+
+# Rasterised text runs, most recently used last, and the bytes they take up
+text_run_cache = collections.OrderedDict()
+text_run_cache_bytes = 0
+text_run_cache_lock = threading.Lock()
+
+def get_text_run(text, font, subpixel=0.0):
+    """
+    Rasterise a run of text once, keyed by text, font and subpixel x offset.
+
+    The mask only holds glyph coverage and the color is applied when it is
+    drawn, so the same run serves every color it is drawn in. Runs are
+    cached by the size of their masks rather than their number, as a
+    wrapped line makes a much larger mask than a word.
+
+    Returns:
+        A tuple of the glyph mask, the position of the text origin inside
+        the mask, the bounding box of the text and its advance width.
+    """
+    global text_run_cache_bytes
+    key = (text, font, subpixel)
+    with text_run_cache_lock:
+        run = text_run_cache.get(key)
+        if run is not None:
+            text_run_cache.move_to_end(key)
+            return run
+    
+    run = rasterise_text_run(text, font, subpixel)
+    with text_run_cache_lock:
+        if key not in text_run_cache:
+            text_run_cache[key] = run
+            text_run_cache_bytes += get_text_run_bytes(run)
+            while text_run_cache_bytes > TEXT_RUN_CACHE_BYTES:
+                text_run_cache_bytes -= get_text_run_bytes(text_run_cache.popitem(last=False)[1])
+    return run
+
+def get_text_run_bytes(run):
+    """Get the bytes a cached text run is counted for"""
+    mask = run[0]
+    return mask.width * mask.height + TEXT_RUN_OVERHEAD
+
+def rasterise_text_run(text, font, subpixel):
+    """Draw the glyph mask of a run of text, see get_text_run"""
+    bbox = font.getbbox(text)
+    origin = (TEXT_RUN_PADDING - min(bbox[0], 0), TEXT_RUN_PADDING - min(bbox[1], 0))
+    size = (origin[0] + max(bbox[2], 0) + TEXT_RUN_PADDING, origin[1] + max(bbox[3], 0) + TEXT_RUN_PADDING)
+    mask = Image.new('L', size, 0)
+    ImageDraw.Draw(mask).text((origin[0] + subpixel, origin[1]), text, 255, font=font)
+    return mask, origin, bbox, font.getlength(text)
+
+def draw_text_run(draw, position, text, fill, font):
+    """Draw text through the text run cache with emoji inline, returns its advance width"""
+    x, y = position
+    for is_emoji, content in split_emoji(text):
+        emoji_image = get_sized_emoji(content, font.size) if is_emoji else None
+        if emoji_image is not None:
+            # Center the emoji on the line
+            ascent, descent = font.getmetrics()
+            emoji_y = int(y) + (ascent + descent - emoji_image.height) // 2
+            with profiling.stage('emoji'):
+                draw.image.alpha_composite(emoji_image, (int(x) + EMOJI_MARGIN, emoji_y))
+            x += emoji_image.width + 2 * EMOJI_MARGIN
+        else:
+            mask, origin, bbox, advance = get_text_run(content, font, x % 1)
+            draw.bitmap((int(x) - origin[0], int(y) - origin[1]), mask, fill=fill)
+            x += advance
+    return x - position[0]
+
+@profiling.timed('mention')
+def draw_mention(draw, position, text, font):
+    """Draw a mention with background and text"""
+    bbox = get_text_run(text, font, position[0] % 1)[2]
+    bbox = (position[0] + bbox[0], position[1] + bbox[1], position[0] + bbox[2], position[1] + bbox[3])
+    
+    # Add padding to make the highlight slightly bigger
+    padding = 6  # Adjust this value for the desired highlight size
+    bbox = (bbox[0] - padding, bbox[1] - padding, bbox[2] + padding, bbox[3] + padding)
+    
+    # Draw rounded rectangle (mention highlight) around the text
+    draw.rounded_rectangle(bbox, radius=MENTION_RADIUS, fill=MENTION_BG_COLOR)
+    draw_text_run(draw, position, text, MENTION_TEXT_COLOR, font)
+
+MARKDOWN_PATTERN = re.compile(r'(\*\*\*.*?\*\*\*|\*\*.*?\*\*|\*.*?\*|__.*?__|~~.*?~~|`.*?`)')
+MENTION_PATTERN = re.compile(r'(@\w+)')
+# Words with the whitespace after them, lines only break between those
+WORD_PATTERN = re.compile(r'\S+\s*|\s+')
+
+# A run of message text drawn in one go, style is 'mention', 'strike' or None
+# and x is its position from the start of its line
+Fragment = collections.namedtuple('Fragment', 'x text font style')
+# A message wrapped into lines of fragments, and the height of its row
+MessageLayout = collections.namedtuple('MessageLayout', 'lines line_height height')
+# The rows of a speaker block, the y of their tops and the height of the
+# frame showing the block up to each of them
+BlockLayout = collections.namedtuple('BlockLayout', 'rows tops heights')
+
+def split_markdown(text, font):
+    """Split markdown text into (text, font, style) segments, without the markdown markers"""
+    segments = []
+    for part in MARKDOWN_PATTERN.split(text):
+        style = None
+        if part.startswith("***") and part.endswith("***") or part.startswith("___") and part.endswith("___"):
+            font_to_use = fonts['bold_italic']
+            clean_text = part[3:-3]
+        elif part.startswith("**") and part.endswith("**") or part.startswith("__") and part.endswith("__"):
+            font_to_use = fonts['bold']
+            clean_text = part[2:-2]
+        elif part.startswith("*") and part.endswith("*") or part.startswith("_") and part.endswith("_"):
+            font_to_use = fonts['italic']
+            clean_text = part[1:-1]
+        elif part.startswith("~~") and part.endswith("~~"):
+            font_to_use = font
+            clean_text = part[2:-2]
+            style = 'strike'
+        elif part.startswith("`") and part.endswith("`"):
+            font_to_use = fonts['monospace']
+            clean_text = part[1:-1]
+        else:
+            font_to_use = font
+            clean_text = part
+        if clean_text:
+            segments.append((clean_text, font_to_use, style))
+    return segments
+
+def split_message(message):
+    """Split a message into (text, font, style) segments, mentions and markdown styles"""
+    message_font = fonts['message']
+    segments = []
+    for i, part in enumerate(MENTION_PATTERN.split(message.strip())):
+        if i % 2:
+            segments.append((part, message_font, 'mention'))
+        else:
+            segments.extend(split_markdown(part, message_font))
+    return segments
+
+def split_characters(text):
+    """Split text into characters, keeping emoji whole, to break words wider than a line"""
+    return [chunk for is_emoji, content in split_emoji(text) for chunk in ((content,) if is_emoji else content)]
+
+@functools.lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def layout_message(message, font_styles):
+    """
+    Wrap a message to MESSAGE_WIDTH.
+
+    Lines break between words, and words wider than a whole line between
+    characters. Widths come from get_text_length, so every word is only
+    measured once per font. font_styles is only part of the cache key, the
+    fonts themselves are taken from the registry.
+    """
+    segments = split_message(message)
+    
+    # Words as lists of (segment index, text), segments that meet without
+    # whitespace in between (e.g. **bold**ed) are part of the same word
+    words = []
+    for i, (text, font, style) in enumerate(segments):
+        for piece in WORD_PATTERN.findall(text):
+            if words and not words[-1][-1][1][-1].isspace():
+                words[-1].append((i, piece))
+            else:
+                words.append([(i, piece)])
+    
+    def get_width(word, trailing_space=True):
+        *head, (i, text) = word
+        width = sum(get_text_length(piece, segments[j][1]) for j, piece in head)
+        return width + get_text_length(text if trailing_space else text.rstrip(), segments[i][1])
+    
+    lines = [[]]
+    x = 0
+    for word in words:
+        if get_width(word, False) > MESSAGE_WIDTH:
+            chunks = [[(i, chunk)] for i, piece in word for chunk in split_characters(piece)]
+        else:
+            chunks = [word]
+        for chunk in chunks:
+            if lines[-1] and x + get_width(chunk, False) > MESSAGE_WIDTH:
+                lines.append([])
+                x = 0
+            if not lines[-1] and len(lines) > 1 and chunk[-1][1].isspace() and len(chunk) == 1:
+                # Whitespace the line broke at
+                continue
+            lines[-1].extend(chunk)
+            x += get_width(chunk)
+    
+    # Pieces of the same segment on a line are drawn as one fragment
+    laid_out = []
+    for line in lines:
+        merged = []
+        for i, piece in line:
+            if merged and merged[-1][0] == i:
+                merged[-1][1] += piece
+            else:
+                merged.append([i, piece])
+        fragments = []
+        x = 0
+        for i, text in merged:
+            font, style = segments[i][1:]
+            fragments.append(Fragment(x, text, font, style))
+            x += get_text_length(text, font)
+        laid_out.append(tuple(fragments))
+    
+    line_height = sum(fonts['message'].getmetrics())
+    return MessageLayout(tuple(laid_out), line_height, len(laid_out) * line_height + MESSAGE_ROW_SPACING)
+
+def get_message_layout(message):
+    """Get the layout of a message with the current fonts"""
+    return layout_message(message, tuple(fonts.styles.items()))
+
+def get_first_row_top():
+    """Get the y of the first message row, so its capital letters start at MESSAGE_TEXT_TOP whatever the font size"""
+    return MESSAGE_TEXT_TOP - fonts['message'].getbbox('H')[1]
+
+def layout_block(messages):
+    """
+    Lay out every message of a speaker block once.
+
+    Frames of the block show a prefix of its rows, the frame showing the
+    first n messages is heights[n - 1] tall.
+    """
+    rows = [get_message_layout(message) for message in messages]
+    tops = []
+    heights = []
+    y = get_first_row_top()
+    for row in rows:
+        tops.append(y)
+        y += row.height
+        heights.append(y + WORLD_BOTTOM_MARGIN)
+    return BlockLayout(rows, tops, heights)
+
+@profiling.timed('text')
+def draw_fragment(draw, position, fragment):
+    """Draw a markdown styled fragment of a message"""
+    advance = draw_text_run(draw, position, fragment.text, MESSAGE_FONT_COLOR, fragment.font)
+    
+    # Strikethrough effect for ~~text~~
+    if fragment.style == 'strike':
+        x, y = position
+        line_y = y + fragment.font.size // 2
+        draw.line((x, line_y, x + advance, line_y), fill=MESSAGE_FONT_COLOR, width=3)
+
+
+def draw_message(draw, position, layout):
+    """Draw a message row from its layout, highlighting mentions and applying markdown"""
+    x, y = position
+    for line in layout.lines:
+        for fragment in line:
+            if fragment.style == 'mention':
+                draw_mention(draw, (x + fragment.x, y), fragment.text, fragment.font)
+            else:
+                draw_fragment(draw, (x + fragment.x, y), fragment)
+        y += layout.line_height
+
+# Prerendered speaker headers, most recently used last, shared by the GUI's generation and preview threads
+header_cache = collections.OrderedDict()
+header_cache_lock = threading.Lock()
+
+@profiling.timed('header')
+def render_header(name, time_text, profpic_file, color, is_bot=False):
+    """Draw the avatar, name, APP badge and time of a speaker block onto a strip"""
+    # Load prepared profile picture
+    prof_pic, mask = get_profile_picture(profpic_file)
+    
+    header = Image.new(mode='RGBA', size=(WORLD_WIDTH, HEADER_HEIGHT), color=WORLD_COLOR)
+    header.paste(prof_pic, PROFPIC_POSITION, mask)
+    header_editable = ImageDraw.Draw(header)
+    
+    # Draw name
+    name_font = fonts['name']
+    header_editable.text(NAME_POSITION, name, color, font=name_font)
+    
+    # Calculate positions for APP badge and time
+    name_width = name_font.getlength(name)
+    current_x = NAME_POSITION[0] + name_width
+    
+    # If bot account, add APP badge
+    if is_bot:
+        current_x += APP_BADGE_SPACING
+        app_badge = get_app_badge()
+        badge_y = NAME_POSITION[1] + (name_font.size - APP_BADGE_HEIGHT) // 2 + 5  # Adjusted to -8 for better centering
+        header.paste(app_badge, (int(current_x), badge_y), app_badge)
+        current_x += app_badge.width
+    
+    # Draw time with updated position
+    time_position = (current_x + NAME_TIME_SPACING, TIME_POSITION_Y)
+    header_editable.text(time_position, time_text, TIME_FONT_COLOR, font=fonts['time'])
+    return header, int(time_position[0])
+
+def get_header(name, time, profpic_file, color, is_bot=False):
+    """
+    Get the prerendered header strip of a speaker block.
+
+    Returns:
+        A tuple of the full header strip, the part of it holding the time
+        (which is all that changes between frames of a block) and the x
+        position of that part.
+    """
+    key = (name, time, profpic_file, color, is_bot, fonts['name'], fonts['time'])
+    # Rebuild when the avatar or badge were reloaded from disk
+    sources = (get_profile_picture(profpic_file), get_app_badge() if is_bot else None)
+    with header_cache_lock:
+        cached = header_cache.get(key)
+        if cached is None or any(old is not new for old, new in zip(cached[0], sources)):
+            header, time_x = render_header(name, f'Today at {time} PM', profpic_file, color, is_bot)
+            # Down to the bottom of the time text, the first message row can start higher up with a large font
+            time_font = fonts['time']
+            time_strip = header.crop((time_x, 0, WORLD_WIDTH, TIME_POSITION_Y + sum(time_font.getmetrics())))
+            cached = (sources, header, time_strip, time_x)
+            header_cache[key] = cached
+            if len(header_cache) > HEADER_CACHE_SIZE:
+                header_cache.popitem(last=False)
+        else:
+            header_cache.move_to_end(key)
+    return cached[1:]
+
+@profiling.timed('generate_chat')
+def generate_chat(messages, name, time, profpic_file, color, is_bot=False, layout=None):
+    """
+    Draw a frame of a speaker block showing the given messages.
+
+    layout can be the layout_block of the whole block, when the messages are
+    the start of it, so they are not laid out again for every frame.
+    """
+    header, time_strip, time_x = get_header(name, time, profpic_file, color, is_bot)
+    layout = layout or layout_block(messages)
+    
+    # Create template
+    template = Image.new(mode='RGBA', size=(WORLD_WIDTH, layout.heights[len(messages)-1]), color=WORLD_COLOR)
+    template.paste(header, (0, 0))
+    template_editable = EmojiDraw(template)
+    
+    # Draw messages
+    for row, top in zip(layout.rows[:len(messages)], layout.tops):
+        draw_message(template_editable, (MESSAGE_X, top), row)
+            
+    return template
+
+@profiling.timed('extend_chat')
+def extend_chat(previous_chat, message, index, name, time, profpic_file, color, is_bot=False, layout=None):
+    """
+    Build the next frame of a speaker block from the previous one.
+
+    Only the new message row and the timestamp are drawn; everything else is
+    copied from the previous frame, so each frame costs the same regardless of
+    how many messages the block already holds.
+
+    Args:
+        previous_chat: The frame returned by generate_chat/extend_chat for the
+                       first `index` messages of the block.
+        message: The message text to add.
+        index: Position of the new message in the block.
+        name, time, profpic_file, color, is_bot, layout: Same as for generate_chat.
+    """
+    if layout is not None:
+        row, top = layout.rows[index], layout.tops[index]
+    else:
+        # The new row starts where the previous frame's last row ended
+        row, top = get_message_layout(message), previous_chat.height - WORLD_BOTTOM_MARGIN
+    template = Image.new(mode='RGBA', size=(WORLD_WIDTH, top + row.height + WORLD_BOTTOM_MARGIN), color=WORLD_COLOR)
+    template.paste(previous_chat, (0, 0))
+    template_editable = EmojiDraw(template)
+    
+    # Refresh time, it moves forward with every frame
+    header, time_strip, time_x = get_header(name, time, profpic_file, color, is_bot)
+    template.paste(time_strip, (time_x, 0))
+    
+    draw_message(template_editable, (MESSAGE_X, top), row)
+    
+    return template
+
+def get_speaker_style(name):
+    """Get the profile picture, name color and bot flag configured for a speaker"""
+    details = get_config()[name]
+    profpic_file = f'profile_pictures/{details["dp"]}'
+    color = tuple(int(details.get("color", "FFFFFF")[i:i+2], 16) for i in (0, 2, 4))
+    return profpic_file, color, details.get("bot", False)
+
+
+def warm_caches():
+    """Load the fonts, speaker configuration and images up front, so the first frames rendered are not slower"""
+    for style in fonts.styles:
+        fonts[style]
+    get_app_badge()
+    for name in get_config():
+        profpic_file = get_speaker_style(name)[0]
+        if os.path.exists(profpic_file):
+            get_profile_picture(profpic_file)
+
+
+@profiling.timed('parse')
+def plan_blocks(lines, init_time, nums_to_skip, dt=30):
+    """
+    Split script lines into speaker blocks and assign every frame its number,
+    timestamp and duration.
+
+    Args:
+        lines: Any iterable of script lines, such as an open file.
+
+    Returns:
+        A list of (name, frames) tuples, one per speaker block, where frames is
+        a list of (msg_number, message, time, delay) tuples.
+    """
+    current_time = init_time
+    current_frames = None
+    msg_number = 1
+
+    blocks = []
+    
+    for event in parse_script(lines):
+        if isinstance(event, ParseError):
+            raise ScriptParseError(event)
+        
+        if isinstance(event, Speaker):
+            current_frames = []
+            blocks.append((event.name, current_frames))
+            continue
+        
+        if not isinstance(event, Message):
+            continue
+        
+        # Handle message duplication
+        for i in range(event.duplication):
+            # Calculate exponential decrease with minimum duration
+            adjusted_delay = event.delay / (2 ** i)
+            adjusted_delay = max(adjusted_delay, 0.2)  # Minimum duration of 0.2 seconds
+            
+            while f'{msg_number:03d}' in nums_to_skip:
+                print(f'found {msg_number:03d}')
+                msg_number += 1
+            
+            current_frames.append((msg_number, event.text, f'{current_time.hour % 12}:{current_time.minute}', adjusted_delay))
+            
+            current_time += datetime.timedelta(0,dt)
+            msg_number += 1
+
+    return [block for block in blocks if block[1]]
+
+
+@profiling.timed('preview')
+def render_preview(lines, line_number=None, reduce=PREVIEW_REDUCE):
+    """
+    Render a low resolution frame of a script, for live previews.
+
+    Shows the speaker block at line_number with its messages up to that line,
+    or the last block of the script when line_number is None. The time is
+    the current time.
+
+    Returns:
+        The frame reduced by `reduce`, or None when there is no message to show.
+    """
+    name = None
+    messages = []
+    for event in parse_script(lines):
+        if line_number is not None and event.line_number > line_number and messages:
+            break
+        if isinstance(event, Speaker):
+            name = event.name
+            messages = []
+        elif isinstance(event, Message) and name is not None:
+            messages.extend([event.text] * event.duplication)
+
+    if not messages:
+        return None
+    messages = messages[-PREVIEW_ROWS:]
+    now = datetime.datetime.now()
+    profpic_file, color, is_bot = get_speaker_style(name)
+    image = generate_chat(messages, name, f'{now.hour % 12}:{now.minute}', profpic_file, color, is_bot)
+    return image.reduce(reduce)
+
+
+def get_render_fingerprint(png_profile=PNG_PROFILE):
+    """Hash everything besides the script itself that affects how frames look"""
+    constants = (
+        WORLD_WIDTH, WORLD_BOTTOM_MARGIN, WORLD_COLOR, PROFPIC_WIDTH, PROFPIC_POSITION,
+        sorted(fonts.styles.items()), NAME_FONT_COLOR, TIME_FONT_COLOR, MESSAGE_FONT_COLOR,
+        NAME_POSITION, TIME_POSITION_Y, NAME_TIME_SPACING, MESSAGE_X, MESSAGE_TEXT_TOP, MESSAGE_ROW_SPACING, MESSAGE_WIDTH,
+        MENTION_BG_COLOR, MENTION_TEXT_COLOR, MENTION_RADIUS, EMOJI_MARGIN, APP_BADGE_HEIGHT, APP_BADGE_SPACING
+    )
+    font_files = [file_fingerprint(path) for path in fonts.paths()]
+    assets = (file_fingerprint('app_button.png'), file_fingerprint(get_emoji_path()))
+    return hash_inputs(RENDER_VERSION, constants, font_files, assets, PNG_PROFILES[png_profile]).hexdigest()
+
+
+def get_frame_keys(name, frames, fingerprint):
+    """
+    Hash the inputs of every frame of a speaker block.
+
+    A frame's key covers the render settings (fingerprint), the block's
+    speaker and style, every message of the block up to the frame, and the
+    frame's time, which is all that decides how it looks. Keys do not
+    depend on frame numbers, so a frame that only moved in the script keeps
+    its key.
+
+    Returns:
+        The key of every frame, or None for every frame when fingerprint is None.
+    """
+    if fingerprint is None:
+        return [None] * len(frames)
+    profpic_file, color, is_bot = get_speaker_style(name)
+    block_hash = hash_inputs(fingerprint, name, file_fingerprint(profpic_file), color, is_bot)
+    keys = []
+    for msg_number, message, time, delay in frames:
+        block_hash.update(message.encode('utf-8') + b'\0')
+        frame_hash = block_hash.copy()
+        frame_hash.update(time.encode('utf-8'))
+        keys.append(frame_hash.hexdigest())
+    return keys
+
+
+def get_conversation_keys(blocks, fingerprint, viewport_height=CONVERSATION_HEIGHT):
+    """
+    Hash the inputs of every frame of a script rendered in conversation mode.
+
+    Frames also show the blocks before their own, so a frame's key covers
+    every block and message of the script up to it. Blocks are shown with
+    the time of their first message.
+
+    Returns:
+        The keys of the frames of every block, as a list per block, or None
+        for every frame when fingerprint is None.
+    """
+    if fingerprint is None:
+        return [[None] * len(frames) for name, frames in blocks]
+    conversation_hash = hash_inputs(fingerprint, 'conversation', viewport_height)
+    block_keys = []
+    for name, frames in blocks:
+        profpic_file, color, is_bot = get_speaker_style(name)
+        conversation_hash.update(repr((name, file_fingerprint(profpic_file), color, is_bot, frames[0][2])).encode('utf-8') + b'\0')
+        keys = []
+        for msg_number, message, time, delay in frames:
+            conversation_hash.update(message.encode('utf-8') + b'\0')
+            keys.append(conversation_hash.hexdigest())
+        block_keys.append(keys)
+    return block_keys
+
+
+def write_frame(sinks, number, image):
+    """Hand a rendered frame to every sink, returns the bytes written and seconds spent by the PngSinks"""
+    size = 0
+    seconds = 0.0
+    for sink in sinks:
+        sink.write(number, image)
+        if isinstance(sink, PngSink):
+            size += sink.stats[-1][1]
+            seconds += sink.stats[-1][2]
+    return size, seconds
+
+
+def skip_frame(sinks, number, path):
+    """Hand a frame that was not rendered again, its image being at path, to every sink"""
+    for sink in sinks:
+        sink.skip(number, path)
+
+
+def render_block(name, frames, keys=None, cache_entries=None, directory=CHAT_DIRECTORY, png_profile=PNG_PROFILE, on_frame=None, cancel_event=None, sinks=None):
+    """
+    Render and save every frame of one speaker block.
+
+    Runs in a worker process when exporting in parallel, so it only takes
+    picklable arguments.
+
+    Args:
+        name: The speaker of the block.
+        frames: The (msg_number, message, time, delay) tuples of the block.
+        keys: The key of every frame, from get_frame_keys. Frames are always
+              rendered when it is None.
+        cache_entries: Frame cache manifest entries of the block's frames.
+        directory: Folder the frame images are written to.
+        png_profile: How the images are encoded, one of sinks.PNG_PROFILES.
+        on_frame: Optional callback, called without arguments after every
+                  frame, rendered or not.
+        cancel_event: Optional threading.Event, the block stops before its
+                      next frame once it is set.
+        sinks: The FrameSinks every frame is handed to, by default a PngSink
+               writing the images into directory with png_profile.
+
+    Returns:
+        A list of (msg_number, key, cached, size, seconds) tuples, where key
+        is the hash of the frame's inputs, cached tells whether rendering was
+        skipped, and size and seconds are the bytes written and the time
+        spent encoding the image by PngSinks (0 for skipped frames). Frames
+        skipped because of a cancellation are not listed.
+    """
+    profpic_file, color, is_bot = get_speaker_style(name)
+    cache_entries = cache_entries or {}
+    keys = keys or [None] * len(frames)
+    layout = layout_block([message for msg_number, message, time, delay in frames])
+    if sinks is None:
+        sinks = [PngSink(directory, png_profile)]
+    
+    messages = []
+    image = None
+    results = []
+    
+    for (msg_number, message, time, delay), key in zip(frames, keys):
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        messages.append(message)
+        image_path = frame_path(directory, msg_number)
+        
+        if key and is_cached(cache_entries.get(frame_filename(msg_number)), image_path, key):
+            # The next rendered frame will need the whole block drawn again
+            image = None
+            skip_frame(sinks, msg_number, image_path)
+            results.append((msg_number, key, True, 0, 0.0))
+            if on_frame is not None:
+                on_frame()
+            continue
+        
+        if image is None:
+            image = generate_chat(
+                messages=messages,
+                name=name,
+                time=time,
+                profpic_file=profpic_file,
+                color=color,
+                is_bot=is_bot,
+                layout=layout
+            )
+        else:
+            # Only draw the new row on top of the previous frame of this block
+            image = extend_chat(
+                image,
+                message=message,
+                index=len(messages) - 1,
+                name=name,
+                time=time,
+                profpic_file=profpic_file,
+                color=color,
+                is_bot=is_bot,
+                layout=layout
+            )
+        
+        size, seconds = write_frame(sinks, msg_number, image)
+        results.append((msg_number, key, False, size, seconds))
+        if on_frame is not None:
+            on_frame()
+    
+    return results
+
+
+def render_block_profiled(*args):
+    """Run render_block in a worker process, returns its results along with the worker's timing samples"""
+    return render_block(*args), profiling.take_samples()
+
+
+def render_conversation(blocks, keys=None, cache_entries=None, directory=CHAT_DIRECTORY, png_profile=PNG_PROFILE, on_frame=None, cancel_event=None, sinks=None):
+    """
+    Render and save every frame of a script in conversation mode.
+
+    Same as render_block, but for all the planned speaker blocks at once, as
+    their frames are crops of the same conversation. keys and cache_entries
+    cover the frames of every block, keys being in frame order.
+    """
+    cache_entries = cache_entries or {}
+    keys = keys or [None] * sum(len(frames) for name, frames in blocks)
+    if sinks is None:
+        sinks = [PngSink(directory, png_profile)]
+    
+    results = []
+    
+    for (msg_number, image), key in zip(iter_conversation_frames(blocks), keys):
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        image_path = frame_path(directory, msg_number)
+        if key and is_cached(cache_entries.get(frame_filename(msg_number)), image_path, key):
+            skip_frame(sinks, msg_number, image_path)
+            results.append((msg_number, key, True, 0, 0.0))
+        else:
+            size, seconds = write_frame(sinks, msg_number, image)
+            results.append((msg_number, key, False, size, seconds))
+        if on_frame is not None:
+            on_frame()
+    
+    return results
+
+
+@profiling.timed('save_images')
+def save_images(lines, init_time, nums_to_skip, dt=30, workers=1, use_cache=True, script_path=None, directory=CHAT_DIRECTORY, png_profile=PNG_PROFILE, progress=None, cancel_event=None, conversation=False, sinks=None):
+    """
+    Render every frame of the script into the chat folder (or the given directory).
+
+    With workers > 1 the speaker blocks are rendered and encoded in parallel
+    on a process pool; frame numbering and the returned durations are the
+    same as for a serial run.
+
+    With use_cache, frames whose inputs (messages, speaker, time, fonts and
+    render settings) match the image already in the chat folder are not
+    rendered again. Images of frames that only moved to another number,
+    e.g. after a message was added earlier in the script, are renamed
+    rather than rendered again.
+
+    Images are encoded with png_profile, one of sinks.PNG_PROFILES, and the
+    bytes written and time spent encoding are reported at the end.
+
+    progress, if given, is called with a Progress (frames done and total,
+    frames per second and estimated seconds left) after every frame, or
+    after every block when exporting in parallel. Setting cancel_event (a
+    threading.Event) stops rendering before the next frame, or before the
+    next block when exporting in parallel. The frames already rendered are
+    still recorded in the frame cache, so the next run picks up from there,
+    and GenerationCancelled is raised.
+
+    With conversation, frames show the whole conversation so far rather
+    than the current speaker block (see iter_conversation_frames). They are
+    rendered in this process, whatever the number of workers.
+
+    sinks, if given, replaces the PngSink writing the chat folder images
+    with a list of FrameSinks, e.g. that PngSink and a video.VideoSink so
+    one render feeds both. They are opened with the returned FrameTable and
+    handed every frame in order, cached ones through skip, and are not
+    closed. They live in this process, so blocks are then rendered here,
+    whatever the number of workers. The frame cache is only used when one
+    of them is a PngSink writing directory.
+
+    Returns:
+        A FrameTable of the rendered frames, in frame order.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if sinks is not None and not any(
+        isinstance(sink, PngSink) and os.path.abspath(sink.directory) == os.path.abspath(directory) for sink in sinks
+    ):
+        use_cache = False
+    
+    blocks = plan_blocks(lines, init_time, nums_to_skip, dt=dt)
+    frame_table = build_frame_table(blocks, directory)
+    for sink in sinks or []:
+        sink.open(frame_table)
+    names = [name for name, frames in blocks]
+    block_frames = [frames for name, frames in blocks]
+    
+    manifest = load_manifest(directory) if use_cache else {'frames': {}}
+    fingerprint = get_render_fingerprint(png_profile) if use_cache else None
+    if conversation:
+        block_keys = get_conversation_keys(blocks, fingerprint)
+    else:
+        block_keys = [get_frame_keys(name, frames, fingerprint) for name, frames in blocks]
+    if use_cache:
+        wanted = {
+            frame_filename(frame[0]): key
+            for frames, keys in zip(block_frames, block_keys)
+            for frame, key in zip(frames, keys)
+        }
+        moved = relocate_frames(manifest, directory, wanted)
+        if moved:
+            print(f"🔀 Frame cache: {moved} frames renumbered")
+    directories = [directory] * len(blocks)
+    png_profiles = [png_profile] * len(blocks)
+    block_entries = [
+        {frame_filename(frame[0]): manifest['frames'].get(frame_filename(frame[0])) for frame in frames}
+        for frames in block_frames
+    ]
+    
+    total = sum(len(frames) for frames in block_frames)
+    done = 0
+    start = time.perf_counter()
+    def advance(count=1):
+        nonlocal done
+        done += count
+        if progress is not None:
+            elapsed = time.perf_counter() - start
+            frames_per_second = done / elapsed if elapsed > 0 else 0.0
+            eta_seconds = (total - done) / frames_per_second if frames_per_second else None
+            progress(Progress(done, total, frames_per_second, eta_seconds))
+    
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+    
+    if conversation:
+        keys = [key for keys in block_keys for key in keys]
+        cache_entries = {filename: entry for entries in block_entries for filename, entry in entries.items()}
+        results = [render_conversation(blocks, keys, cache_entries, directory, png_profile, on_frame=advance, cancel_event=cancel_event, sinks=sinks)]
+    elif workers > 1 and len(blocks) > 1 and sinks is None:
+        # Workers load the fonts they need themselves, with the same styles as this process
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(blocks)), initializer=init_worker, initargs=(fonts.styles,)) as executor:
+            results = [[] for _ in blocks]
+            futures = {
+                executor.submit(render_block_profiled, *args): i
+                for i, args in enumerate(zip(names, block_frames, block_keys, block_entries, directories, png_profiles))
+            }
+            pending = set(futures)
+            while pending:
+                finished, pending = concurrent.futures.wait(pending, timeout=CANCEL_POLL_INTERVAL, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    if future.cancelled():
+                        continue
+                    block_results, samples = future.result()
+                    results[futures[future]] = block_results
+                    profiling.merge_samples(samples)
+                    advance(len(block_results))
+                if cancelled():
+                    # Blocks already running in a worker are finished and kept
+                    pending = {future for future in pending if not future.cancel()}
+    else:
+        results = []
+        for args in zip(names, block_frames, block_keys, block_entries, directories, png_profiles):
+            results.append(render_block(*args, on_frame=advance, cancel_event=cancel_event, sinks=sinks))
+            if cancelled():
+                break
+    
+    hits = misses = 0
+    png_bytes = 0
+    png_seconds = 0.0
+    slowest = 0.0
+    for block_results in results:
+        for msg_number, key, cached, size, seconds in block_results:
+            if cached:
+                hits += 1
+            else:
+                misses += 1
+                png_bytes += size
+                png_seconds += seconds
+                slowest = max(slowest, seconds)
+                if use_cache:
+                    record_frame(manifest, directory, msg_number, key)
+    
+    if use_cache:
+        manifest['start_time'] = init_time.isoformat()
+        manifest['script'] = os.path.abspath(script_path) if script_path else None
+        save_manifest(directory, manifest)
+        print(f"♻️ Frame cache: {hits} reused, {misses} rendered")
+    if misses and png_bytes:
+        print(f"💾 PNG ({png_profile}): {png_bytes / 1e6:.2f} MB, {png_bytes / misses / 1e3:.0f} kB and "
+              f"{png_seconds / misses * 1e3:.1f} ms per frame (slowest {slowest * 1e3:.1f} ms)")
+    if hits + misses < total:
+        raise GenerationCancelled(f'Cancelled after {hits + misses} of {total} frames')
+    
+    return frame_table
+
+
+def build_frame_table(blocks, directory=CHAT_DIRECTORY):
+    """Get the FrameTable of planned speaker blocks, in frame order"""
+    frames = FrameTable(directory)
+    for name, block in blocks:
+        for msg_number, message, time, delay in block:
+            frames.append(msg_number, delay, name, message)
+    return frames
+
+
+def iter_conversation_frames(blocks, viewport_height=CONVERSATION_HEIGHT):
+    """
+    Render planned speaker blocks as one scrolling conversation, in frame order.
+
+    Every block is drawn once, with all its messages and the time of its
+    first one, below the blocks before it. The frame of a message is then a
+    crop of the conversation: the viewport_height pixels (fewer at the
+    start) ending at that message's row, so later messages are not shown
+    yet. Only the part of the conversation that can still appear in a frame
+    is kept, so memory does not grow with the length of the script.
+
+    Yields:
+        (msg_number, image) tuples, images are not drawn on once yielded.
+    """
+    conversation = Image.new(mode='RGBA', size=(WORLD_WIDTH, 0), color=WORLD_COLOR)
+    for name, frames in blocks:
+        profpic_file, color, is_bot = get_speaker_style(name)
+        messages = [message for msg_number, message, time, delay in frames]
+        layout = layout_block(messages)
+        block = generate_chat(messages, name, frames[0][2], profpic_file, color, is_bot, layout)
+        
+        # Keep what can still show above this block
+        kept_height = min(conversation.height, viewport_height)
+        previous = conversation.crop((0, conversation.height - kept_height, WORLD_WIDTH, conversation.height))
+        conversation = Image.new(mode='RGBA', size=(WORLD_WIDTH, kept_height + block.height), color=WORLD_COLOR)
+        conversation.paste(previous, (0, 0))
+        conversation.paste(block, (0, kept_height))
+        
+        for i, ((msg_number, message, time, delay), height) in enumerate(zip(frames, layout.heights)):
+            bottom = kept_height + height
+            with profiling.stage('crop'):
+                image = conversation.crop((0, max(0, bottom - viewport_height), WORLD_WIDTH, bottom))
+                if i < len(frames) - 1:
+                    # The margin below the row holds the top of the next one
+                    ImageDraw.Draw(image).rectangle((0, image.height - WORLD_BOTTOM_MARGIN, WORLD_WIDTH, image.height), fill=WORLD_COLOR)
+            yield msg_number, image
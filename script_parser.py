@@ -0,0 +1,92 @@
+import collections
+import re
+
+# Script format:
+#
+#   Speaker:                  first line of a block is the speaker name
+#   message$^0.7$x3           message, shown for 0.7 seconds, duplicated 3 times
+#   # comment                 ignored
+#                             a blank line ends the block
+#
+# The delay ($^) and duplication ($x) suffixes are both optional.
+
+DEFAULT_DELAY = 1.0
+
+Speaker = collections.namedtuple('Speaker', 'name line_number')
+Message = collections.namedtuple('Message', 'text delay duplication line_number')
+BlockBreak = collections.namedtuple('BlockBreak', 'line_number')
+ParseError = collections.namedtuple('ParseError', 'error line line_number')
+
+DELAY_SUFFIX = re.compile(r'^(?P<delay>[^$]*)(?:\$x(?P<duplication>.*))?$')
+DUPLICATION_SUFFIX = re.compile(r'\$x(?P<duplication>\d+)\s*$')
+
+
+class ScriptParseError(ValueError):
+    """Raised when a script line cannot be parsed"""
+    def __init__(self, event):
+        super().__init__(f'Line {event.line_number}: {event.error} ({event.line!r})')
+        self.line_number = event.line_number
+
+
+def parse_message(line, line_number):
+    """Parse a message line into a Message, or a ParseError if its suffix is malformed"""
+    message_parts = line.split('$^', 1)
+    text = message_parts[0]
+    delay = DEFAULT_DELAY
+    duplication = '1'
+
+    if len(message_parts) > 1:
+        match = DELAY_SUFFIX.match(message_parts[1])
+        if not match:
+            return ParseError('Unexpected "$" after delay', line, line_number)
+        try:
+            delay = float(match['delay'])
+        except ValueError:
+            return ParseError(f'Invalid delay {match["delay"]!r}', line, line_number)
+        if match['duplication'] is not None:
+            duplication = match['duplication']
+    else:
+        # Duplication without a delay, as written by the script writer
+        match = DUPLICATION_SUFFIX.search(text)
+        if match:
+            text = text[:match.start()]
+            duplication = match['duplication']
+
+    # Trailing whitespace is allowed, as int() ignores it
+    duplication = duplication.strip()
+    if not duplication.isdigit():
+        return ParseError(f'Invalid duplication {duplication!r}', line, line_number)
+    return Message(text, delay, int(duplication), line_number)
+
+
+def parse_script(lines):
+    """
+    Parse a script into a stream of events.
+
+    Args:
+        lines: Any iterable of lines, such as an open file; lines are read
+               one at a time so the script never has to be fully in memory.
+
+    Yields:
+        Speaker, Message and BlockBreak events in script order, and a
+        ParseError for every line that could not be parsed.
+    """
+    name_up_next = True
+
+    for line_number, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+
+        if not line.strip():
+            name_up_next = True
+            yield BlockBreak(line_number)
+            continue
+
+        if line[0] == '#':
+            continue
+
+        if name_up_next:
+            name_up_next = False
+            yield Speaker(line.split(':')[0].strip(), line_number)
+            continue
+
+        yield parse_message(line, line_number)
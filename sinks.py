@@ -0,0 +1,176 @@
+"""
+Frame sinks, the consumers rendered frames are handed to.
+
+The renderer only produces PIL images, what happens to them is up to a sink:
+PngSink saves them as the chat folder images, MemorySink keeps them for
+code running in the same process, RingBufferSink copies their pixels into
+shared memory for other processes, and video.VideoSink encodes them with
+ffmpeg. Sinks are passed to renderer.save_images, which hands every frame
+to all of them as it is rendered, in frame order, so one render feeds
+several outputs without writing and decoding intermediate PNGs.
+"""
+import collections
+import os
+import time
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+import profiling
+from frames import frame_path
+
+# How frame images are encoded: Pillow's PNG save options, and the number of
+# palette colors frames are quantised to first (None keeps them RGBA)
+PngProfile = collections.namedtuple('PngProfile', ['save_options', 'palette_colors'])
+
+PNG_PROFILES = {
+    # Pillow defaults, zlib level 6
+    'default': PngProfile({}, None),
+    # Fastest to write, larger files
+    'fast': PngProfile({'compress_level': 1}, None),
+    # Lossless, smallest RGBA files, slowest to write
+    'archival': PngProfile({'optimize': True}, None),
+    # Palette images, the Discord theme only needs a few colors besides anti-aliasing and avatars
+    'compact': PngProfile({'optimize': True}, 256),
+}
+
+
+class FrameSink:
+    """
+    Base class of frame sinks.
+
+    open is called once with the FrameTable of the frames to come, then
+    every frame is handed over in frame order: to write, with its number
+    and image, or to skip when it was not rendered again because its image
+    in the chat folder is up to date (see frame_cache.py). Images must not
+    be modified, they can be the base of the next frame. close finishes the
+    output once every frame was handed over, abort gives it up when
+    rendering failed. Sinks can be used as context managers, which closes
+    them at the end, or aborts them when an exception is raised.
+    """
+
+    def open(self, frames):
+        pass
+
+    def write(self, number, image):
+        raise NotImplementedError
+
+    def skip(self, number, path):
+        """Hand over a frame that was not rendered again, by default reading its image from path"""
+        with Image.open(path) as image:
+            self.write(number, image.convert('RGBA'))
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class PngSink(FrameSink):
+    """
+    Save frames as numbered PNG images in a folder, encoded with one of PNG_PROFILES.
+
+    The size in bytes and the encoding time of every frame written are kept
+    in stats, as (number, bytes, seconds) tuples.
+    """
+
+    def __init__(self, directory, profile='default'):
+        self.directory = directory
+        self.profile = PNG_PROFILES[profile]
+        self.stats = []
+
+    def write(self, number, image):
+        path = frame_path(self.directory, number)
+        start = time.perf_counter()
+        with profiling.stage('png_encode'):
+            if self.profile.palette_colors:
+                image = image.convert('RGB').quantize(self.profile.palette_colors, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+            image.save(path, **self.profile.save_options)
+        self.stats.append((number, os.path.getsize(path), time.perf_counter() - start))
+
+    def skip(self, number, path):
+        # Frames skipped in the folder this sink writes are already there
+        if os.path.abspath(path) != os.path.abspath(frame_path(self.directory, number)):
+            super().skip(number, path)
+
+
+class MemorySink(FrameSink):
+    """Keep the frame images in memory, by frame number, without copying them"""
+
+    def __init__(self):
+        self.images = {}
+
+    def write(self, number, image):
+        self.images[number] = image
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, number):
+        return self.images[number]
+
+
+class RingBufferSink(FrameSink):
+    """
+    Copy the raw pixels of frames into a ring of slots in shared memory.
+
+    Other processes attach to the shared memory by its name and read frames
+    without them being pickled or encoded. A slot is reused once `slots`
+    more frames have been written, so consumers have to keep up, or be
+    called back through on_frame as each frame is written.
+
+    Args:
+        slots: Number of frames the ring holds.
+        slot_size: Size of a slot in bytes, at least that of the largest
+                   frame (width * height * 4 for RGBA).
+        on_frame: Optional callback, called with (number, mode, size,
+                  memoryview of the pixels) for every frame written.
+    """
+
+    def __init__(self, slots, slot_size, on_frame=None):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.on_frame = on_frame
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self.count = 0
+        # Number, mode and size of the frame held by every slot
+        self.frames = [None] * slots
+
+    @property
+    def name(self):
+        """Name of the shared memory, to attach to it from other processes"""
+        return self.memory.name
+
+    def write(self, number, image):
+        data = image.tobytes()
+        if len(data) > self.slot_size:
+            raise ValueError(f'frame {number} is {len(data)} bytes, larger than the {self.slot_size} byte slots')
+
+        slot = self.count % self.slots
+        offset = slot * self.slot_size
+        self.memory.buf[offset:offset + len(data)] = data
+        self.frames[slot] = (number, image.mode, image.size)
+        self.count += 1
+
+        if self.on_frame is not None:
+            self.on_frame(number, image.mode, image.size, self.view(slot))
+
+    def view(self, slot):
+        """Get a memoryview of the pixels of the frame held by a slot"""
+        number, mode, (width, height) = self.frames[slot]
+        offset = slot * self.slot_size
+        return self.memory.buf[offset:offset + width * height * len(mode)]
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
@@ -0,0 +1,46 @@
+from script_parser import parse_message, parse_script, Speaker, Message, BlockBreak, ParseError
+
+
+def test_delay_and_duplication():
+    assert parse_message('true lol$^0.7$x3', 1) == Message('true lol', 0.7, 3, 1)
+
+
+def test_trailing_whitespace_after_duplication():
+    assert parse_message('true lol$^0.7$x3 ', 1) == Message('true lol', 0.7, 3, 1)
+    assert parse_message('true lol$^0.7$x3\t', 1) == Message('true lol', 0.7, 3, 1)
+
+
+def test_trailing_whitespace_after_delay():
+    assert parse_message('true lol$^0.7 ', 1) == Message('true lol', 0.7, 1, 1)
+
+
+def test_duplication_without_delay():
+    assert parse_message('true lol$x3', 1) == Message('true lol', 1.0, 3, 1)
+    assert parse_message('true lol$x3 ', 1) == Message('true lol', 1.0, 3, 1)
+
+
+def test_dollar_in_text_without_suffix():
+    assert parse_message('costs $x or $5', 1) == Message('costs $x or $5', 1.0, 1, 1)
+
+
+def test_invalid_suffixes():
+    assert isinstance(parse_message('true lol$^fast', 1), ParseError)
+    assert isinstance(parse_message('true lol$^0.7$x', 1), ParseError)
+    assert isinstance(parse_message('true lol$^0.7$xthree', 1), ParseError)
+    assert isinstance(parse_message('true lol$^0.7$3', 1), ParseError)
+
+
+def test_whitespace_only_line_ends_block():
+    events = list(parse_script(['Beluga:', 'hi', '   ', 'Hecker:', 'hey']))
+    assert events == [
+        Speaker('Beluga', 1),
+        Message('hi', 1.0, 1, 2),
+        BlockBreak(3),
+        Speaker('Hecker', 4),
+        Message('hey', 1.0, 1, 5),
+    ]
+
+
+def test_comments_and_line_endings():
+    events = list(parse_script(['Beluga:\r\n', '# note\r\n', 'hi$^0.5\r\n']))
+    assert events == [Speaker('Beluga', 1), Message('hi', 0.5, 1, 3)]
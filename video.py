@@ -0,0 +1,236 @@
+"""
+Direct video export, as an alternative to importing the XML into Premiere Pro.
+
+Frames are handed to a VideoSink, which lays each one out like the Premiere
+sequence (scaled down and centred on a vertical 1080x1920 canvas) and saves
+it once as a still. ffmpeg then reads the stills through a concat list that
+holds each one for the same number of video frames as its clip in the XML.
+The notification sound is decoded once and mixed into a single audio track,
+starting with every clip, which ffmpeg reads as a WAV file. ffmpeg has to be
+installed and on the PATH (or set FFMPEG_PATH).
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import wave
+from array import array
+
+from PIL import Image
+
+import profiling
+from renderer import save_images
+from sinks import FrameSink
+from xml_builder import Timeline
+
+LOCAL_DIRECTORY = os.getcwd()
+NOTIFICATION_PATH = os.path.join(LOCAL_DIRECTORY, 'discord-notification.mp3')
+
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+
+# Same layout as the Premiere sequence, frames are scaled to 61% and centred
+VIDEO_WIDTH = 1080
+VIDEO_HEIGHT = 1920
+VIDEO_SCALE = 0.61
+VIDEO_BACKGROUND = (0, 0, 0, 255)
+VIDEO_FPS = 60
+VIDEO_CODEC_ARGS = ['-c:v', 'libx264', '-preset', 'medium', '-crf', '18', '-pix_fmt', 'yuv420p']
+AUDIO_CODEC_ARGS = ['-c:a', 'aac', '-b:a', '192k']
+
+# Stills are only read back once by ffmpeg, so they are barely compressed
+STILL_SAVE_OPTIONS = {'compress_level': 1}
+
+# The audio track is mixed as 16 bit stereo PCM
+AUDIO_RATE = 48000
+AUDIO_CHANNELS = 2
+
+
+def compose_video_frame(image):
+    """Place a chat frame on the video canvas"""
+    scaled = image.resize((round(image.width * VIDEO_SCALE), round(image.height * VIDEO_SCALE)), Image.Resampling.BICUBIC)
+    canvas = Image.new('RGBA', (VIDEO_WIDTH, VIDEO_HEIGHT), VIDEO_BACKGROUND)
+    canvas.paste(scaled, ((VIDEO_WIDTH - scaled.width) // 2, (VIDEO_HEIGHT - scaled.height) // 2))
+    return canvas
+
+
+def decode_audio(audio_path, duration_sec):
+    """Decode the first duration_sec of a sound with ffmpeg, returns its interleaved 16 bit samples"""
+    result = subprocess.run(
+        [
+            FFMPEG_PATH, '-loglevel', 'error', '-i', audio_path, '-t', str(duration_sec),
+            '-f', 's16le', '-ac', str(AUDIO_CHANNELS), '-ar', str(AUDIO_RATE), '-'
+        ],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+    )
+    samples = array('h', result.stdout)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+
+def mix_audio_track(timeline, sound, fps):
+    """
+    Mix a decoded sound into one track, starting with every clip of the timeline.
+
+    The sound is copied into a silent buffer at each clip's start, and only
+    added sample by sample where it overlaps the previous copy.
+
+    Returns:
+        The interleaved 16 bit samples of the track, as long as the timeline.
+    """
+    track = array('h', bytes(timeline.total_duration * AUDIO_RATE // fps * AUDIO_CHANNELS * 2))
+    end = 0
+    for start in timeline.starts:
+        offset = start * AUDIO_RATE // fps * AUDIO_CHANNELS
+        clip = sound[:len(track) - offset]
+        if offset >= end:
+            track[offset:offset + len(clip)] = clip
+        else:
+            for i, sample in enumerate(clip):
+                track[offset + i] = max(-32768, min(32767, track[offset + i] + sample))
+        end = max(end, offset + len(clip))
+    return track
+
+
+def write_wav(path, samples):
+    """Write interleaved 16 bit samples as a WAV file"""
+    if sys.byteorder == 'big':
+        samples = array('h', samples)
+        samples.byteswap()
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(AUDIO_CHANNELS)
+        f.setsampwidth(2)
+        f.setframerate(AUDIO_RATE)
+        f.writeframes(samples.tobytes())
+
+
+def write_concat_list(path, stills, fps):
+    """
+    Write the ffmpeg concat list showing every still for its number of video frames.
+
+    Args:
+        path: The list file to write, stills are listed relative to it.
+        stills: (path, frame count) tuples, in order.
+        fps: Frames per second of the video.
+    """
+    lines = ['ffconcat version 1.0']
+    for still_path, frame_count in stills:
+        lines.append(f"file '{os.path.basename(still_path)}'")
+        lines.append(f'duration {frame_count / fps}')
+    if stills:
+        # The duration of the last still is only used when it is listed again
+        lines.append(f"file '{os.path.basename(stills[-1][0])}'")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def build_ffmpeg_command(output_path, concat_path, audio_track_path, fps):
+    """Build the ffmpeg command reading the stills of a concat list, and the audio track if any, and writing the finished video"""
+    command = [FFMPEG_PATH, '-y', '-loglevel', 'error', '-f', 'concat', '-i', concat_path]
+    if audio_track_path is not None:
+        command += ['-i', audio_track_path, '-map', '0:v', '-map', '1:a'] + AUDIO_CODEC_ARGS
+    return command + ['-r', str(fps)] + VIDEO_CODEC_ARGS + ['-movflags', '+faststart', output_path]
+
+
+class VideoSink(FrameSink):
+    """
+    Encode frames into a video with ffmpeg.
+
+    open takes the FrameTable of the frames that will be written, for their
+    durations. Frames must be written in the same order, e.g. by passing the
+    sink to renderer.save_images. Each one is saved once as a still in a
+    temporary folder, and close mixes the audio track and runs ffmpeg on
+    them. abort only removes the temporary folder, so an existing video is
+    not replaced by a partial one when rendering fails.
+
+    Args:
+        output_path: The video file to write.
+        audio_duration_sec: How much of the notification sound is played.
+        audio_path: The notification sound, the video is silent if it does
+                    not exist.
+        fps: Frames per second of the video.
+    """
+
+    def __init__(self, output_path='output.mp4', audio_duration_sec=0.3, audio_path=NOTIFICATION_PATH, fps=VIDEO_FPS):
+        self.output_path = output_path
+        self.audio_duration_sec = audio_duration_sec
+        self.audio_path = audio_path
+        self.fps = fps
+        self.timeline = None
+        self.temp_directory = None
+        self.audio_track_path = None
+        self.stills = []
+        self.index = 0
+        self.succeeded = None
+
+    def open(self, frames):
+        self.timeline = Timeline(frames, audio_duration_sec=self.audio_duration_sec, audio_path=self.audio_path, fps=self.fps)
+        self.temp_directory = tempfile.mkdtemp(prefix='textshotter-video-')
+        self.audio_track_path = None
+        self.stills = []
+        self.index = 0
+
+    def write(self, number, image):
+        i = self.index
+        self.index += 1
+        frame_count = self.timeline.ends[i] - self.timeline.starts[i]
+        if not frame_count:
+            # Shorter than a video frame, it would not show
+            return
+        path = os.path.join(self.temp_directory, f'{i:06d}.png')
+        with profiling.stage('video_still'):
+            compose_video_frame(image).save(path, **STILL_SAVE_OPTIONS)
+        self.stills.append((path, frame_count))
+
+    def close(self):
+        """Finish the video, returns whether it was written"""
+        if self.succeeded is None and self.timeline is None:
+            # Never opened, so there was nothing to encode
+            self.succeeded = False
+        elif self.succeeded is None:
+            if len(self.timeline) and os.path.exists(self.audio_path):
+                with profiling.stage('audio_mix'):
+                    try:
+                        sound = decode_audio(self.audio_path, self.audio_duration_sec)
+                    except subprocess.CalledProcessError as e:
+                        print(f'⚠️ Could not decode {self.audio_path}, the video is silent: {e.stderr.decode("utf-8", "replace").strip()}')
+                    else:
+                        self.audio_track_path = os.path.join(self.temp_directory, 'audio.wav')
+                        write_wav(self.audio_track_path, mix_audio_track(self.timeline, sound, self.fps))
+            concat_path = os.path.join(self.temp_directory, 'stills.ffconcat')
+            write_concat_list(concat_path, self.stills, self.fps)
+            command = build_ffmpeg_command(self.output_path, concat_path, self.audio_track_path, self.fps)
+            with profiling.stage('video_encode'):
+                result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            shutil.rmtree(self.temp_directory, ignore_errors=True)
+            self.succeeded = result.returncode == 0
+            if self.succeeded:
+                print("✅ Successfully encoded the video")
+            else:
+                print(f'❌ An error occured while encoding the video: {result.stderr.decode("utf-8", "replace").strip()}')
+        return self.succeeded
+
+    def abort(self):
+        """Give up the video without running ffmpeg, the output file is left as it was"""
+        if self.temp_directory is not None:
+            shutil.rmtree(self.temp_directory, ignore_errors=True)
+        self.succeeded = False
+
+
+def has_ffmpeg():
+    """Whether ffmpeg can be found, prints how to fix it when it can't"""
+    if shutil.which(FFMPEG_PATH) is None:
+        print(f'❌ Could not find ffmpeg ({FFMPEG_PATH}), install it or set FFMPEG_PATH to export videos.')
+        return False
+    return True
+
+
+def render_video(lines, init_time, nums_to_skip, dt=30, output_path='output.mp4', fps=VIDEO_FPS, conversation=False):
+    """Render a script straight into a video, without writing frame images, returns whether it was written"""
+    if not has_ffmpeg():
+        return False
+    sink = VideoSink(output_path=output_path, fps=fps)
+    with sink:
+        save_images(lines, init_time, nums_to_skip, dt=dt, use_cache=False, conversation=conversation, sinks=[sink])
+    return sink.succeeded
@@ -0,0 +1,61 @@
+"""
+Watch mode, regenerating a script's frames and XML whenever it is saved.
+
+Files are polled rather than watched through OS notifications, so it works
+the same everywhere without extra dependencies. A change is only reported
+once the files have stopped changing for DEBOUNCE_SECONDS, so an editor
+saving in several steps, or a writer saving a few times in a row, causes a
+single regeneration. Regenerating goes through save_images, whose frame
+cache only renders the frames the edit actually changed and renames those
+that only moved.
+"""
+import os
+import threading
+
+POLL_INTERVAL = 0.5
+DEBOUNCE_SECONDS = 0.5
+
+
+def get_mtimes(paths):
+    """Get the modification time of every file, None for missing ones"""
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def watch(paths, on_change, stop_event=None, interval=POLL_INTERVAL, debounce=DEBOUNCE_SECONDS):
+    """
+    Call on_change every time the files change, until stop_event is set.
+
+    Args:
+        paths: The files to watch, e.g. the script and details.yaml.
+        on_change: Called without arguments once the files have settled
+                   after a change. Changes made while it runs are picked
+                   up once it returns.
+        stop_event: A threading.Event that stops watching when set.
+        interval: Seconds between two checks of the files.
+        debounce: Seconds the files must stay unchanged before on_change
+                  is called.
+    """
+    stop_event = stop_event or threading.Event()
+    last_mtimes = get_mtimes(paths)
+    # Seconds the files have been unchanged since their last change, None when they did not change
+    settled_for = None
+
+    while not stop_event.wait(interval):
+        mtimes = get_mtimes(paths)
+        if mtimes != last_mtimes:
+            last_mtimes = mtimes
+            settled_for = 0.0
+            continue
+        if settled_for is None:
+            continue
+
+        settled_for += interval
+        if settled_for >= debounce:
+            settled_for = None
+            on_change()
@@ -1,61 +1,90 @@
 from jinja2 import Environment, FileSystemLoader, BaseLoader
+from array import array
+import collections
+import functools
 import uuid
 import os
+import profiling
 
 LOCAL_DIRECTORY = os.getcwd()
 
+# Number of template chunks joined before every write to the XML file
+XML_WRITE_BUFFER = 256
 
-def calculate_image_and_audio_timings(image_durations_sec, audio_duration_sec, audio_path, fps):
-    """
-    Calculates start and end times in frames for images and audio.
 
-    Args:
-        image_durations_sec: A dictionary where keys are image paths and 
-                             values are their durations in seconds.
-        audio_path: The path to the audio file.
-        audio_duration_sec: The duration of the audio clip in seconds.
-        fps: Frames per second (default is 60).
+# A clip of the sequence, as seen by the template
+VideoClip = collections.namedtuple('VideoClip', ['image_path', 'start', 'end', 'name'])
+AudioClip = collections.namedtuple('AudioClip', ['audio_path', 'start', 'end', 'name'])
 
-    Returns:
-        A tuple containing two lists of dictionaries:
-            - image_timings: Each dictionary contains 'image_path', 'start', 
-                             'end', and 'name'.
-            - audio_timings: Each dictionary contains 'audio_path', 'start', 
-                             'end', and 'name'.
+
+class ClipView:
+    """Read-only sequence of the clips of a Timeline, created one at a time as they are read"""
+    __slots__ = ('timeline', 'clip')
+
+    def __init__(self, timeline, clip):
+        self.timeline = timeline
+        self.clip = clip
+
+    def __len__(self):
+        return len(self.timeline)
+
+    def __getitem__(self, i):
+        return self.clip(i)
+
+    def __iter__(self):
+        return map(self.clip, range(len(self.timeline)))
+
+
+class Timeline:
     """
+    Placement of the frames on the sequence, in frames at the given fps.
 
-    image_timings = []
-    audio_timings = []
-    current_frame = 0
+    Frames are laid out one after another in a single pass when the timeline
+    is built. Only their start and end frames are stored, in typed arrays,
+    along with the total duration of the sequence. Every frame also starts
+    an audio clip of the notification sound, lasting audio_duration_sec.
+    The clip objects the template reads are only created as they are read,
+    through the video_clips and audio_clips views.
 
-    for image_path, duration_sec in image_durations_sec.items():
-        image_start_frame = current_frame
-        image_end_frame = current_frame + int(round(duration_sec * fps))  # Convert to frames
+    Args:
+        frames: A FrameTable of the rendered images and their durations
+                in seconds.
+        audio_duration_sec: The duration of the audio clip in seconds.
+        audio_path: The path to the audio file.
+        fps: Frames per second of the sequence.
+    """
+    __slots__ = ('frames', 'audio_path', 'audio_name', 'audio_frames', 'starts', 'ends', 'total_duration')
 
-        image_name = os.path.basename(image_path)
+    def __init__(self, frames, audio_duration_sec, audio_path, fps):
+        self.frames = frames
+        self.audio_path = audio_path
+        self.audio_name = os.path.basename(audio_path)
+        self.audio_frames = int(round(audio_duration_sec * fps))
+        self.starts = array('I')
+        self.ends = array('I')
+        self.total_duration = 0
 
-        image_timings.append({
-            'image_path': image_path,
-            'start': image_start_frame,
-            'end': image_end_frame,
-            'name': image_name
-        })
+        current_frame = 0
+        for duration_sec in frames.durations:
+            self.starts.append(current_frame)
+            current_frame += int(round(duration_sec * fps))  # Convert to frames
+            self.ends.append(current_frame)
+            self.total_duration = max(self.total_duration, current_frame, self.starts[-1] + self.audio_frames)
 
-        audio_start_frame = current_frame
-        audio_end_frame = current_frame + int(round(audio_duration_sec * fps))  # Use audio_duration_sec
+    def __len__(self):
+        return len(self.starts)
 
-        audio_name = os.path.basename(audio_path)
+    def video_clip(self, i):
+        return VideoClip(self.frames.path(i), self.starts[i], self.ends[i], self.frames.filename(i))
 
-        audio_timings.append({
-            'audio_path': audio_path,
-            'start': audio_start_frame,
-            'end': audio_end_frame,
-            'name': audio_name
-        })
+    def audio_clip(self, i):
+        return AudioClip(self.audio_path, self.starts[i], self.starts[i] + self.audio_frames, self.audio_name)
 
-        current_frame = image_end_frame
+    def video_clips(self):
+        return ClipView(self, self.video_clip)
 
-    return image_timings, audio_timings
+    def audio_clips(self):
+        return ClipView(self, self.audio_clip)
 
 
 # Define the Jinja2 template as a string
@@ -314,45 +343,56 @@ TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
     </sequence>
 </xmeml>'''
 
-def generate_fcpxml(video_clips, audio_clips):
+@functools.lru_cache(maxsize=None)
+def get_template():
+    """Get the XML template, compiled on first use and then reused for the rest of the process"""
+    env = Environment(loader=BaseLoader(), auto_reload=False)
+    return env.from_string(TEMPLATE)
+
+def get_template_context(timeline):
+    """Get the variables the template is rendered with"""
+    return {
+        'video_clips': timeline.video_clips(),
+        'audio_clips': timeline.audio_clips(),
+        'total_duration': timeline.total_duration
+    }
+
+def generate_fcpxml(timeline):
     """
-    Generate Final Cut Pro XML from video and audio clip data.
+    Generate Final Cut Pro XML from a timeline.
     
     Args:
-        video_clips (list): List of dictionaries containing video clip information
-        audio_clips (list): List of dictionaries containing audio clip information
+        timeline (Timeline): Placement of the video and audio clips
     
     Returns:
         str: Generated XML string
     """
-    # Calculate total duration based on the last ending time
-    total_duration = max(
-        max(clip['end'] for clip in video_clips),
-        max(clip['end'] for clip in audio_clips)
-    )
-    
-    # Create Jinja2 environment and template
-    env = Environment(loader=BaseLoader())
-    template = env.from_string(TEMPLATE)
-    
-    # Render template with clip data
-    xml_content = template.render(
-        video_clips=video_clips,
-        audio_clips=audio_clips,
-        total_duration=total_duration
-    )
-    
-    return xml_content
+    return get_template().render(get_template_context(timeline))
+
+def write_fcpxml(timeline, output_path):
+    """
+    Write Final Cut Pro XML from video and audio clip data to a file.
 
-def create_xml(image_durations_sec, audio_duration_sec=0.3, audio_path=rf'{LOCAL_DIRECTORY}\discord-notification.mp3', fps=60):
+    The template is rendered in chunks that are written as they come, so the
+    whole document is never held in memory. It is written next to
+    output_path first and moved in place once complete, so a failed export
+    does not leave a truncated XML behind.
+    """
+    stream = get_template().stream(get_template_context(timeline))
+    stream.enable_buffering(XML_WRITE_BUFFER)
+    with open(output_path + '.tmp', 'w', encoding='utf-8') as f:
+        stream.dump(f)
+    os.replace(output_path + '.tmp', output_path)
+
+@profiling.timed('xml')
+def create_xml(frames, audio_duration_sec=0.3, audio_path=rf'{LOCAL_DIRECTORY}\discord-notification.mp3', fps=60, output_path='output.xml'):
     try:
 
-        image_clips, audio_clips = calculate_image_and_audio_timings(image_durations_sec, audio_duration_sec=audio_duration_sec, audio_path=audio_path, fps=60)
+        timeline = Timeline(frames, audio_duration_sec=audio_duration_sec, audio_path=audio_path, fps=60)
 
-        xml_content = generate_fcpxml(image_clips, audio_clips)
-    
-        with open('output.xml', 'w', encoding='utf-8') as f:
-            f.write(xml_content)
+        write_fcpxml(timeline, output_path)
         print("✅ Successfully generated XML file, ready to import in Premiere Pro")
+        return True
     except:
         print('❌ An error occured while generating XML, could not finish.')
+        return False